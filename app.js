@@ -273,35 +273,309 @@ function hide_facet_when_no_data(facet_id, games, attr) {
   }
 }
 
-function init(SETTINGS) {
+function tokenize(text) {
+  // Must match tokenize() in scripts/mybgg/static_index.py, or searches won't find anything
+  return String(text).normalize("NFKD").replace(/\p{Mn}/gu, "").toLowerCase().match(/[\p{L}\p{N}]+/gu) || [];
+}
 
-  var configIndexName = ''
-  switch (SETTINGS.algolia.sort_by) {
-    case undefined:
-    case 'asc(name)':
-      configIndexName = SETTINGS.algolia.index_name
-      break
-    case 'asc(rank)':
-    case 'desc(rating)':
-      configIndexName = SETTINGS.algolia.index_name + '_rank_ascending'
-      break
-    case 'desc(numrated)':
-      configIndexName = SETTINGS.algolia.index_name + '_numrated_descending'
-      break
-    case 'desc(numowned)':
-      configIndexName = SETTINGS.algolia.index_name + '_numowned_descending'
-      break
-    default:
-      console.error("The provided config value for algolia.sort_by was invalid: " + SETTINGS.algolia.sort_by)
+function load_static_index(path) {
+  return fetch(path)
+    .then(function(response) { return response.arrayBuffer(); })
+    .then(function(buffer) {
+      var bytes = new Uint8Array(buffer);
+      // Servers that send the file with Content-Encoding: gzip have already unpacked it for us
+      if (bytes[0] == 0x1f && bytes[1] == 0x8b) {
+        var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+        return new Response(stream).json();
+      }
+      return JSON.parse(new TextDecoder().decode(bytes));
+    })
+    .then(function(data) { return new StaticIndex(data); });
+}
+
+function StaticIndex(data) {
+  this.data = data;
+  this.records = data.records;
+  this.num_words = Math.ceil(data.records.length / 32);
+
+  function decode_bitmap(encoded) {
+    var binary = atob(encoded);
+    var bytes = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) {
+      bytes[i] = binary.charCodeAt(i);
+    }
+    return new Uint32Array(bytes.buffer);
+  }
+
+  this.facets = {};
+  for (var path in data.facets) {
+    this.facets[path] = {};
+    for (var value in data.facets[path]) {
+      this.facets[path][value] = decode_bitmap(data.facets[path][value]);
+    }
+  }
+}
+
+StaticIndex.prototype.all = function() {
+  var bitmap = new Uint32Array(this.num_words).fill(0xffffffff);
+  var remainder = this.records.length % 32;
+  if (remainder) {
+    bitmap[this.num_words - 1] = (1 << remainder) - 1;
+  }
+  return bitmap;
+};
+
+StaticIndex.prototype.has = function(bitmap, position) {
+  return (bitmap[position >>> 5] >>> (position & 31)) & 1;
+};
+
+StaticIndex.prototype.count = function(bitmap, other) {
+  var count = 0;
+  for (var i = 0; i < bitmap.length; i++) {
+    var word = bitmap[i] & other[i];
+    word = word - ((word >>> 1) & 0x55555555);
+    word = (word & 0x33333333) + ((word >>> 2) & 0x33333333);
+    count += (((word + (word >>> 4)) & 0x0f0f0f0f) * 0x01010101) >>> 24;
+  }
+  return count;
+};
+
+StaticIndex.prototype.match_token = function(token, is_prefix, bitmap, scores) {
+  // The terms are sorted, so all words starting with the token come right after each other
+  var terms = this.data.terms;
+  var low = 0, high = terms.length;
+  while (low < high) {
+    var middle = (low + high) >>> 1;
+    if (terms[middle][0] < token) { low = middle + 1; } else { high = middle; }
+  }
+
+  var num_attributes = this.data.searchable_attributes.length;
+  var best = {};
+  for (var i = low; i < terms.length; i++) {
+    var term = terms[i][0];
+    if (is_prefix ? term.indexOf(token) != 0 : term != token) {
       break;
+    }
+    for (var attribute = 0; attribute < num_attributes; attribute++) {
+      var position = 0;
+      terms[i][attribute + 1].forEach(function(delta) {
+        position += delta;
+        bitmap[position >>> 5] |= 1 << (position & 31);
+        if (!(position in best) || attribute < best[position]) {
+          best[position] = attribute;
+        }
+      });
+    }
+  }
+
+  // Games matching the query in earlier attributes, like the name, rank higher
+  for (var position in best) {
+    scores[position] = (scores[position] || 0) + best[position];
+  }
+};
+
+StaticIndex.prototype.filter = function(params, scores) {
+  var self = this;
+  var bitmap = this.all();
+
+  function and(other) {
+    for (var i = 0; i < bitmap.length; i++) { bitmap[i] &= other[i]; }
+  }
+
+  // All words have to match, and the last one is a prefix since the user might still be typing
+  var tokens = tokenize(params.query || "");
+  tokens.forEach(function(token, i) {
+    var matches = new Uint32Array(self.num_words);
+    self.match_token(token, i == tokens.length - 1, matches, scores);
+    and(matches);
+  });
+
+  // Filters in the outer list are ANDed together, and filters in inner lists are ORed
+  (params.facetFilters || []).forEach(function(facet_filter) {
+    var alternatives = Array.isArray(facet_filter) ? facet_filter : [facet_filter];
+    var matches = new Uint32Array(self.num_words);
+    alternatives.forEach(function(alternative) {
+      var separator = alternative.indexOf(":");
+      var path = alternative.slice(0, separator), value = alternative.slice(separator + 1);
+      var is_negated = value[0] == "-";
+      if (is_negated) {
+        value = value.slice(1);
+      }
+      var value_bitmap = (self.facets[path] || {})[value] || new Uint32Array(self.num_words);
+      var all = self.all();
+      for (var i = 0; i < matches.length; i++) {
+        matches[i] |= is_negated ? all[i] & ~value_bitmap[i] : value_bitmap[i];
+      }
+    });
+    and(matches);
+  });
+
+  var numeric_filters = (params.numericFilters || []).map(function(numeric_filter) {
+    var alternatives = Array.isArray(numeric_filter) ? numeric_filter : [numeric_filter];
+    return alternatives.map(function(alternative) {
+      var match = alternative.match(/^\s*([\w.]+)\s*(<=|>=|!=|<|>|=)\s*(-?[\d.]+)\s*$/);
+      return {attribute: match[1], operator: match[2], number: parseFloat(match[3])};
+    });
+  });
+  if (numeric_filters.length) {
+    var compare = {
+      "<": function(a, b) { return a < b; },
+      "<=": function(a, b) { return a <= b; },
+      "=": function(a, b) { return a == b; },
+      "!=": function(a, b) { return a != b; },
+      ">=": function(a, b) { return a >= b; },
+      ">": function(a, b) { return a > b; }
+    };
+    this.records.forEach(function(record, position) {
+      var is_match = numeric_filters.every(function(alternatives) {
+        return alternatives.some(function(f) {
+          var value = record[f.attribute];
+          return typeof value == "number" && compare[f.operator](value, f.number);
+        });
+      });
+      if (!is_match) {
+        bitmap[position >>> 5] &= ~(1 << (position & 31));
+      }
+    });
+  }
+
+  return {bitmap: bitmap, tokens: tokens};
+};
+
+StaticIndex.prototype.highlight = function(value, tokens, pre_tag, post_tag) {
+  return String(value).replace(/[\p{L}\p{N}\p{Mn}]+/gu, function(word) {
+    var term = tokenize(word)[0] || "";
+    var is_match = tokens.some(function(token, i) {
+      return i == tokens.length - 1 ? term.indexOf(token) == 0 : term == token;
+    });
+    return is_match ? pre_tag + word + post_tag : word;
+  });
+};
+
+StaticIndex.prototype.facet_counts = function(bitmap, path, max_values) {
+  var counts = [];
+  var values = this.facets[path] || {};
+  for (var value in values) {
+    var count = this.count(bitmap, values[value]);
+    if (count) {
+      counts.push([value, count]);
+    }
+  }
+  counts.sort(function(a, b) { return b[1] - a[1] || (a[0] < b[0] ? -1 : 1); });
+
+  var result = {};
+  counts.slice(0, max_values).forEach(function(item) { result[item[0]] = item[1]; });
+  return result;
+};
+
+StaticIndex.prototype.search = function(index_name, params) {
+  var self = this;
+  var started = Date.now();
+  var scores = {};
+  var filtered = this.filter(params, scores);
+  var index = this.data.indexes[index_name];
+
+  var positions = index.order.filter(function(position) { return self.has(filtered.bitmap, position); });
+  if (filtered.tokens.length && index.relevance) {
+    // Array.sort is stable, so games with the same relevance keep the order of the index
+    positions.sort(function(a, b) { return scores[a] - scores[b]; });
+  }
+
+  var facets = params.facets || [];
+  if (!Array.isArray(facets)) {
+    facets = [facets];
+  }
+  if (facets.indexOf("*") > -1) {
+    facets = Object.keys(this.facets);
+  }
+  var facet_counts = {};
+  facets.forEach(function(path) {
+    facet_counts[path] = self.facet_counts(filtered.bitmap, path, params.maxValuesPerFacet || 100);
+  });
+
+  // Same fallbacks as algolia: the index's own setting, then the one replicas share with their primary index
+  var settings = this.data.settings[index_name] || {};
+  var primary_settings = this.data.settings[settings.primary] || settings;
+  var hits_per_page = [params.hitsPerPage, settings.hitsPerPage, primary_settings.hitsPerPage, 20].find(function(value) {
+    return value !== undefined;
+  });
+  var page = params.page || 0;
+  var pre_tag = params.highlightPreTag || "<em>";
+  var post_tag = params.highlightPostTag || "</em>";
+  var hits = positions.slice(page * hits_per_page, (page + 1) * hits_per_page).map(function(position) {
+    var hit = Object.assign({}, self.records[position], {_highlightResult: {}});
+    self.data.searchable_attributes.forEach(function(attribute) {
+      if (typeof hit[attribute] == "string") {
+        var value = self.highlight(hit[attribute], filtered.tokens, pre_tag, post_tag);
+        hit._highlightResult[attribute] = {
+          value: value,
+          matchLevel: value != hit[attribute] ? "full" : "none",
+          matchedWords: []
+        };
+      }
+    });
+    return hit;
+  });
+
+  return {
+    hits: hits,
+    nbHits: positions.length,
+    page: page,
+    nbPages: hits_per_page ? Math.ceil(positions.length / hits_per_page) : 0,
+    hitsPerPage: hits_per_page,
+    facets: facet_counts,
+    exhaustiveFacetsCount: true,
+    exhaustiveNbHits: true,
+    processingTimeMS: Date.now() - started,
+    query: params.query || "",
+    params: "",
+    index: index_name
+  };
+};
+
+StaticIndex.prototype.search_for_facet_values = function(index_name, params) {
+  var self = this;
+  var started = Date.now();
+  var filtered = this.filter(params, {});
+  var facet_tokens = tokenize(params.facetQuery || "");
+  var counts = this.facet_counts(filtered.bitmap, params.facetName, Infinity);
+
+  var facet_hits = [];
+  for (var value in counts) {
+    var highlighted = this.highlight(value, facet_tokens, params.highlightPreTag || "<em>", params.highlightPostTag || "</em>");
+    if (!facet_tokens.length || highlighted != value) {
+      facet_hits.push({value: value, highlighted: highlighted, count: counts[value]});
+    }
   }
 
+  return {
+    facetHits: facet_hits.slice(0, params.maxFacetHits || 10),
+    exhaustiveFacetsCount: true,
+    processingTimeMS: Date.now() - started
+  };
+};
+
+StaticIndex.prototype.search_client = function() {
+  // Answers instantsearch's queries in the browser, instead of sending them to algolia
+  var self = this;
+  return {
+    search: function(requests) {
+      return Promise.resolve({
+        results: requests.map(function(request) { return self.search(request.indexName, request.params || {}); })
+      });
+    },
+    searchForFacetValues: function(requests) {
+      return Promise.resolve(requests.map(function(request) {
+        return self.search_for_facet_values(request.indexName, request.params || {});
+      }));
+    }
+  };
+};
+
+function start_search(indexName, searchClient, SETTINGS) {
   const search = instantsearch({
-    indexName: configIndexName,
-    searchClient: algoliasearch(
-      SETTINGS.algolia.app_id,
-      SETTINGS.algolia.api_key_search_only
-    ),
+    indexName: indexName,
+    searchClient: searchClient,
     routing: true
   });
 
@@ -325,6 +599,50 @@ function init(SETTINGS) {
   ]);
 
   search.start();
+}
+
+function init(SETTINGS) {
+
+  var configIndexName = ''
+  switch (SETTINGS.algolia.sort_by) {
+    case undefined:
+    case 'asc(name)':
+      configIndexName = SETTINGS.algolia.index_name
+      break
+    case 'asc(rank)':
+    case 'desc(rating)':
+      configIndexName = SETTINGS.algolia.index_name + '_rank_ascending'
+      break
+    case 'desc(numrated)':
+      configIndexName = SETTINGS.algolia.index_name + '_numrated_descending'
+      break
+    case 'desc(numowned)':
+      configIndexName = SETTINGS.algolia.index_name + '_numowned_descending'
+      break
+    default:
+      console.error("The provided config value for algolia.sort_by was invalid: " + SETTINGS.algolia.sort_by)
+      break;
+  }
+
+  if (SETTINGS.project.static_index) {
+    load_static_index(SETTINGS.project.static_index).then(function(static_index) {
+      start_search(configIndexName, static_index.search_client(), SETTINGS);
+    }).catch(function(error) {
+      // A missing file, or a browser without DecompressionStream, would otherwise leave an empty page
+      console.error("Could not load the static index " + SETTINGS.project.static_index + ":", error);
+      document.getElementById('hits').textContent = (
+        "Could not load the games from " + SETTINGS.project.static_index + ". " +
+        "Make sure the file exists, and that your browser is up to date."
+      );
+    });
+  }
+  else {
+    start_search(
+      configIndexName,
+      algoliasearch(SETTINGS.algolia.app_id, SETTINGS.algolia.api_key_search_only),
+      SETTINGS
+    );
+  }
 
   function set_bgg_name() {
     var title = SETTINGS.project.title;
@@ -1,42 +1,209 @@
+import hashlib
 import json
 
+from mybgg.checkpoint import Checkpoint
 from mybgg.downloader import Downloader
+from mybgg.indexer import ColorCacheSqlite
 from mybgg.indexer import Indexer
+from mybgg.indexer import IndexManifest
+from mybgg.local_search import LocalSearchClient
+from mybgg.snapshot import CollectionSnapshot
+from mybgg.snapshot import save_snapshot
+from mybgg.static_index import StaticIndexClient
 
 
 def main(args):
     SETTINGS = json.load(open("config.json", "rb"))
 
+    if args.batch:
+        sites = load_batch(args.batch, SETTINGS)
+    else:
+        sites = [{
+            "user_name": SETTINGS["boardgamegeek"]["user_name"],
+            "extra_params": SETTINGS["boardgamegeek"]["extra_params"],
+            "index_name": SETTINGS["algolia"]["index_name"],
+        }]
+
+    # Where the indexes live, local files or an algolia app
+    destination = args.local_index or args.static_index or f"algolia:{SETTINGS['algolia']['app_id']}"
+
+    # Everything done so far is recorded, so that a failed run can be picked up with --resume.
+    # The run key holds everything that shapes the records, so that they're only reused when
+    # the resumed run would have built the same ones.
+    checkpoint = Checkpoint(
+        path=f"{SETTINGS['project']['name']}-checkpoint.sqlite",
+        run_key={
+            "sites": sites,
+            "destination": destination,
+            "from_snapshot": args.from_snapshot,
+            "fast_colors": args.fast_colors,
+        },
+        resume=args.resume,
+    )
+
     downloader = Downloader(
         project_name=SETTINGS["project"]["name"],
         cache_bgg=args.cache_bgg,
         debug=args.debug,
+        max_workers=args.bgg_concurrency,
+        requests_per_second=args.bgg_requests_per_second,
+        incremental_plays=args.incremental_plays,
+        trace_path=args.trace_requests,
+        cache_games=args.cache_games,
+        cache_max_size=args.cache_max_size * 1024 * 1024,
+        use_async=args.async_bgg,
+        checkpoint=checkpoint,
     )
-    collection = downloader.collection(
-        user_name=SETTINGS["boardgamegeek"]["user_name"],
-        extra_params=SETTINGS["boardgamegeek"]["extra_params"],
-    )
-    num_games = len(collection)
-    num_expansions = sum([len(game.expansions) for game in collection])
-    print(f"Imported {num_games} games and {num_expansions} expansions from boardgamegeek.")
 
-    if not len(collection):
-        assert False, "No games imported, is the boardgamegeek part of config.json correctly set?"
+    snapshot = None
+    if args.from_snapshot:
+        snapshot = CollectionSnapshot(args.from_snapshot)
+        collections = [snapshot]
+    elif args.stream:
+        # Games are built, enriched and uploaded while the rest of them are still downloading
+        collections = [downloader.iter_collection(sites[0]["user_name"], sites[0]["extra_params"])]
+    else:
+        collections = downloader.collections([(site["user_name"], site["extra_params"]) for site in sites])
 
+    client = None
+    color_cache = None
     if not args.no_indexing:
+        if args.local_index:
+            client = LocalSearchClient(args.local_index)
+        elif args.static_index:
+            client = StaticIndexClient(args.static_index)
+
+        if args.cache_colors:
+            color_cache = ColorCacheSqlite(f"{SETTINGS['project']['name']}-colors.sqlite")
+
+    for site, collection in zip(sites, collections):
+        prefix = f"{site['user_name']}: " if args.batch else ""
+        streamed_games = None
+        if args.stream and not args.no_indexing:
+            streamed_games = {}
+            collection = keep_streamed_games(collection, streamed_games)
+        else:
+            # Snapshots are read lazily, everything else is turned into a list
+            if not isinstance(collection, CollectionSnapshot):
+                collection = list(collection)
+
+            # One empty collection shouldn't stop the others in the batch from being indexed
+            if args.batch and not len(collection):
+                print(f"{prefix}No games imported, skipping. Is the user_name in {args.batch} correct?")
+                continue
+
+            num_games, num_expansions = report_imported(prefix, collection, args)
+            if args.snapshot:
+                save_collection_snapshot(prefix, site, collection, args.snapshot)
+
+        if args.no_indexing:
+            print(f"{prefix}Skipped indexing.")
+            continue
+
         hits_per_page = SETTINGS["algolia"].get("hits_per_page", 48)
+        manifest = None
+        if args.delta_indexing:
+            # Each destination has manifests of its own, since they hold different records
+            manifest_name = f"{site['index_name']}-manifest" if args.batch else "manifest"
+            destination_hash = hashlib.sha1(destination.encode("utf-8")).hexdigest()[:8]
+            manifest = IndexManifest(
+                path=f"{SETTINGS['project']['name']}-{manifest_name}-{destination_hash}.json",
+                index_name=site["index_name"],
+                destination=destination,
+            )
+
         indexer = Indexer(
             app_id=SETTINGS["algolia"]["app_id"],
             apikey=args.apikey,
-            index_name=SETTINGS["algolia"]["index_name"],
+            index_name=site["index_name"],
             hits_per_page=hits_per_page,
+            image_workers=args.image_workers,
+            color_cache=color_cache,
+            fast_colors=args.fast_colors,
+            manifest=manifest,
+            batch_size=args.batch_size,
+            force_settings=args.force_settings,
+            client=client,
+            checkpoint=checkpoint,
         )
-        indexer.add_objects(collection)
+        indexer.add_objects(collection, wait=args.wait_for_indexing)
+        if streamed_games is not None:
+            collection = list(streamed_games.values())
+            num_games, num_expansions = report_imported(prefix, collection, args)
+            if args.snapshot:
+                save_collection_snapshot(prefix, site, collection, args.snapshot)
+
         indexer.delete_objects_not_in(collection)
+        if args.static_index:
+            client.save()
+
+        print(
+            f"{prefix}Indexed {num_games} games and {num_expansions} expansions in "
+            f"{args.local_index or args.static_index or 'algolia'}, "
+            "and removed everything else."
+        )
+
+    if snapshot:
+        snapshot.close()
+
+    checkpoint.remove()
+
+    if downloader.cache:
+        if args.compact_cache:
+            downloader.cache.compact()
+
+        stats = downloader.cache.stats()
+        print(
+            f"BGG cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+            f"{stats['bytes_read'] / 1024:.0f} kB read, {stats['bytes_written'] / 1024:.0f} kB written, "
+            f"{stats['size'] / 1024 / 1024:.1f} MB stored."
+        )
+
+    if downloader.tracer:
+        downloader.tracer.close()
+
+
+def report_imported(prefix, collection, args):
+    num_games = len(collection)
+    num_expansions = sum([len(game.expansions) for game in collection])
+    source = args.from_snapshot or "boardgamegeek"
+    print(f"{prefix}Imported {num_games} games and {num_expansions} expansions from {source}.")
+
+    if not len(collection):
+        assert False, f"{prefix}No games imported, is the boardgamegeek part of config.json correctly set?"
+
+    return num_games, num_expansions
 
-        print(f"Indexed {num_games} games and {num_expansions} expansions in algolia, and removed everything else.")
-    else:
-        print("Skipped indexing.")
+
+def save_collection_snapshot(prefix, site, collection, path):
+    save_snapshot(path, collection, user_name=site["user_name"])
+    print(f"{prefix}Saved a snapshot of the collection to {path}.")
+
+
+def keep_streamed_games(games, streamed_games):
+    # A game can be streamed again when a late expansion changes it, keep its latest version
+    for game in games:
+        streamed_games[game.id] = game
+        yield game
+
+
+def load_batch(path, SETTINGS):
+    """
+    Reads a JSON list of the collections to download and index in one run. Every entry needs a
+    user_name, and can set its own extra_params and index_name. They default to the extra_params
+    in config.json, and to the index_name in config.json followed by the user name.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+
+    return [
+        {
+            "user_name": entry["user_name"],
+            "extra_params": entry.get("extra_params", SETTINGS["boardgamegeek"]["extra_params"]),
+            "index_name": entry.get("index_name", f"{SETTINGS['algolia']['index_name']}_{entry['user_name']}"),
+        }
+        for entry in entries
+    ]
 
 
 if __name__ == '__main__':
@@ -46,9 +213,78 @@ if __name__ == '__main__':
     parser.add_argument(
         '--apikey',
         type=str,
-        required=True,
+        required=False,
         help='The admin api key for your algolia site'
     )
+    parser.add_argument(
+        '--local_index',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Index into a local SQLite database at PATH instead of algolia. "
+            "It supports the same searches, facets and sort orders as the "
+            "algolia index, and doesn't need an api key."
+        )
+    )
+    parser.add_argument(
+        '--static_index',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Write a gzipped static search index to PATH instead of indexing "
+            "in algolia. Point project.static_index in config.json to it, and the site "
+            "loads it once and searches in the browser, without algolia."
+        )
+    )
+    parser.add_argument(
+        '--batch',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Download and index many collections at once, as listed in the JSON "
+            "file at PATH, instead of the one in config.json. Games that are in "
+            "several collections are only fetched from boardgamegeek once. Example: "
+            '[{"user_name": "alice", "index_name": "club_alice"}, {"user_name": "bob"}]'
+        )
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help=(
+            "Index games while the rest of the collection is still downloading, "
+            "instead of waiting for all of it first. Can't be combined with --batch "
+            "or --async_bgg."
+        )
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help=(
+            "Pick up where the last run stopped, if it failed. The games it downloaded, "
+            "the records it built and the batches it uploaded are reused instead of "
+            "done again. Runs record their progress in PROJECT-checkpoint.sqlite, which "
+            "is removed once a run completes."
+        )
+    )
+    parser.add_argument(
+        '--snapshot',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Save the downloaded collection to a compressed snapshot at PATH, "
+            "that can be indexed again later with --from_snapshot."
+        )
+    )
+    parser.add_argument(
+        '--from_snapshot',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Index the collection saved in the snapshot at PATH, instead of "
+            "downloading it from boardgamegeek. Useful to index again, or to "
+            "benchmark indexing, against the same data."
+        )
+    )
     parser.add_argument(
         '--no_indexing',
         action='store_true',
@@ -66,6 +302,118 @@ if __name__ == '__main__':
             "fast the second time it's run. Bug doesn't fetch new data från BGG."
         )
     )
+    parser.add_argument(
+        '--cache_max_size',
+        type=int,
+        default=100,
+        metavar='MB',
+        help=(
+            "Maximum size of the compressed BGG cache. When it's full, the "
+            "least recently used responses are evicted."
+        )
+    )
+    parser.add_argument(
+        '--compact_cache',
+        action='store_true',
+        help="Remove expired responses from the BGG cache and shrink the file at the end of the run."
+    )
+    parser.add_argument(
+        '--cache_games',
+        action='store_true',
+        help=(
+            "Cache the data of each game separately between runs, and only fetch "
+            "games that are new or have been cached for more than a day."
+        )
+    )
+    parser.add_argument(
+        '--async_bgg',
+        action='store_true',
+        help=(
+            "Download from boardgamegeek with asyncio, over one pool of keep-alive "
+            "connections, and fetch plays while collections and games are downloading. "
+            "Can't be combined with --cache_bgg."
+        )
+    )
+    parser.add_argument(
+        '--incremental_plays',
+        action='store_true',
+        help=(
+            "Remember who has played which game between runs, and only fetch "
+            "plays logged since the last run. Edited or deleted old plays are "
+            "not picked up, remove the -plays.json file to start over."
+        )
+    )
+    parser.add_argument(
+        '--bgg_concurrency',
+        type=int,
+        default=4,
+        help="Number of requests to BGG that are allowed to be in flight at the same time."
+    )
+    parser.add_argument(
+        '--bgg_requests_per_second',
+        type=float,
+        default=2,
+        help="Maximum number of requests per second sent to BGG, including retries."
+    )
+    parser.add_argument(
+        '--trace_requests',
+        type=str,
+        metavar='PATH',
+        help=(
+            "Append one JSON line per request made to BGG to this file, with "
+            "url, status, bytes, latency and retries. Cheap enough for production runs."
+        )
+    )
+    parser.add_argument(
+        '--delta_indexing',
+        action='store_true',
+        help=(
+            "Remember what was sent to algolia in the last run, and only send "
+            "games that are new or changed, and delete games that are gone. "
+            "Remove the -manifest-*.json files to send everything again."
+        )
+    )
+    parser.add_argument(
+        '--force_settings',
+        action='store_true',
+        help=(
+            "Send all index and replica settings to algolia, even the ones "
+            "that are already up to date."
+        )
+    )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=500,
+        help="Number of games sent to algolia in each request. Batches are sent while images are processed."
+    )
+    parser.add_argument(
+        '--wait_for_indexing',
+        action='store_true',
+        help="Wait until algolia has finished indexing all batches before exiting."
+    )
+    parser.add_argument(
+        '--cache_colors',
+        action='store_true',
+        help=(
+            "Remember the color picked for each cover image between runs, so "
+            "that only new images are downloaded and analysed."
+        )
+    )
+    parser.add_argument(
+        '--fast_colors',
+        action='store_true',
+        help=(
+            "Pick cover colors from a small thumbnail with a vectorized version "
+            "of colorgram. Much faster, but colors can differ slightly."
+        )
+    )
+    parser.add_argument(
+        '--image_workers',
+        type=int,
+        default=8,
+        help="Number of cover images that are downloaded at the same time while indexing."
+    )
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -73,5 +421,19 @@ if __name__ == '__main__':
     )
 
     args = parser.parse_args()
+    if args.local_index and args.static_index:
+        parser.error("--local_index and --static_index can't be used together")
+    if args.async_bgg and args.cache_bgg:
+        parser.error("--cache_bgg only caches synchronous requests, and can't be used with --async_bgg")
+    if args.stream and (args.batch or args.async_bgg):
+        parser.error("--stream can't be used with --batch or --async_bgg")
+    if args.batch and (args.snapshot or args.from_snapshot):
+        parser.error("Snapshots hold a single collection, and can't be used with --batch")
+    if args.from_snapshot and (args.stream or args.snapshot):
+        parser.error("--from_snapshot doesn't download anything, and can't be used with --stream or --snapshot")
+    if args.batch and args.static_index:
+        parser.error("--static_index holds a single collection, and can't be used with --batch")
+    if not args.apikey and not args.local_index and not args.static_index and not args.no_indexing:
+        parser.error("--apikey is required, unless indexing into a --local_index or --static_index")
 
     main(args)
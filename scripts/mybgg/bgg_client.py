@@ -1,123 +1,297 @@
+import asyncio
+import itertools
+import json
 import logging
+import math
+import pickle
+import random
+import re
+import sqlite3
+import threading
 import time
+import zlib
+from collections import deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from xml.etree.ElementTree import fromstring
 
 import declxml as xml
+import httpx
 import requests
 from requests_cache import CachedSession
+from requests_cache.backends.base import BaseCache
 
 logger = logging.getLogger(__name__)
 
 class BGGClient:
     BASE_URL = "https://www.boardgamegeek.com/xmlapi2"
-
-    def __init__(self, cache=None, debug=False):
-        if not cache:
+    MAX_TRIES = 10
+    PLAYS_PER_PAGE = 100
+
+    # 202 Accepted, 429 Too Many Requests, and 5xx errors from an overloaded BGG
+    RETRY_STATUS_CODES = (202, 429, 500, 502, 503, 504)
+
+    def __init__(self, cache=None, debug=False, max_workers=4, requests_per_second=2, rate_limiter=None,
+                 parser="fast", tracer=None, game_cache=None, checkpoint=None, requester=None):
+        self.cache = cache
+        if requester:
+            self.requester = requester
+        elif not cache:
             self.requester = requests.Session()
         else:
             self.requester = cache.cache
 
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_second)
+
+        if parser not in ("fast", "declxml"):
+            raise ValueError(f"Unknown parser: {parser}")
+        self.parser = parser
+        self.tracer = tracer
+        self.game_cache = game_cache
+        self.checkpoint = checkpoint
+
         if debug:
             logging.basicConfig(level=logging.DEBUG)
 
     def collection(self, user_name, **kwargs):
-        params = kwargs.copy()
-        params["username"] = user_name
-        data = self._make_request("/collection?version=1", params)
+        data = self._make_request("/collection?version=1", user_params(user_name, kwargs))
         collection = self._collection_to_games(data)
         return collection
 
     def plays(self, user_name):
-        params = {
-            "username": user_name,
-            "page": 1,
-        }
-        all_plays = []
-
-        data = self._make_request("/plays?version=1", params)
-        new_plays = self._plays_to_games(data)
-
-        while (len(new_plays) > 0):
-            all_plays = all_plays + new_plays
-            params["page"] += 1
-            data = self._make_request("/plays?version=1", params)
-            new_plays = self._plays_to_games(data)
-
-        return all_plays
+        return [play for plays in self.iter_plays(user_name) for play in plays]
+
+    def iter_plays(self, user_name, **kwargs):
+        """
+        Yield the plays of a user one page at a time, newest first.
+
+        The first page tells how many plays there are in total, so the remaining pages
+        are prefetched concurrently. Callers can stop iterating at any time, which
+        cancels the pages that haven't been requested yet.
+        """
+        params = user_params(user_name, kwargs)
+
+        total, plays = self._plays_page(params, page=1)
+        if not plays:
+            return
+
+        yield plays
+
+        if total is None:
+            # Without a total we can't prefetch, walk the pages until an empty one
+            page = 2
+            _, plays = self._plays_page(params, page=page)
+            while plays:
+                yield plays
+                page += 1
+                _, plays = self._plays_page(params, page=page)
+            return
+
+        pages = remaining_plays_pages(total)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = deque(
+                executor.submit(self._plays_page, params, page=page)
+                for page in itertools.islice(pages, self.max_workers)
+            )
+            try:
+                while in_flight:
+                    _, plays = in_flight.popleft().result()
+                    for page in itertools.islice(pages, 1):
+                        in_flight.append(executor.submit(self._plays_page, params, page=page))
+
+                    if plays:
+                        yield plays
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def _plays_page(self, params, page):
+        data = self._make_request("/plays?version=1", dict(params, page=page))
+        return self._plays_to_games(data)
 
     def game_list(self, game_ids):
-        if not game_ids:
-            return []
-
-        # Split game_ids into smaller chunks to avoid "414 URI too long"
-        def chunks(iterable, n):
-            for i in range(0, len(iterable), n):
-                yield iterable[i:i + n]
-
+        game_ids, id_to_game, missing_ids = self._games_to_fetch(game_ids)
+        return self._merge_fetched_games(game_ids, id_to_game, self._game_list_fetch(missing_ids))
+
+    def _games_to_fetch(self, game_ids):
+        # Only ask BGG for the games that are missing from the stores or have gone stale
+        game_ids = list(dict.fromkeys(game_ids))
+        id_to_game = self._stored_games(game_ids)
+        missing_ids = [id_ for id_ in game_ids if id_ not in id_to_game]
+        if id_to_game:
+            logger.debug(f"Found {len(id_to_game)} of {len(game_ids)} games in the game cache.")
+
+        return game_ids, id_to_game, missing_ids
+
+    @staticmethod
+    def _merge_fetched_games(game_ids, id_to_game, fetched_games):
+        id_to_game.update({game["id"]: game for game in fetched_games})
+        return [id_to_game[id_] for id_ in game_ids if id_ in id_to_game]
+
+    def _stored_games(self, game_ids):
+        # Games downloaded by an interrupted run are reused no matter how old they are,
+        # while the game cache only returns the ones that are still fresh
+        id_to_game = {}
+        for store in (self.checkpoint, self.game_cache):
+            if store:
+                id_to_game.update(store.get_many([id_ for id_ in game_ids if id_ not in id_to_game]))
+
+        return id_to_game
+
+    def _store_games(self, games):
+        for store in (self.checkpoint, self.game_cache):
+            if store:
+                store.set_many(games)
+
+    def _game_list_fetch(self, game_ids):
+        # Keep several chunks in flight at once, map() returns them in input order. Store each
+        # chunk as soon as it arrives, so that an interrupted run loses as little as possible.
         games = []
-        for game_ids_subset in chunks(game_ids, 100):
-            url = "/thing/?stats=1&id=" + ",".join([str(id_) for id_ in game_ids_subset])
-            data = self._make_request(url)
-            games += self._games_list_to_games(data)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for chunk_games in executor.map(self._game_list_chunk, game_id_chunks(game_ids)):
+                self._store_games(chunk_games)
+                games += chunk_games
 
         return games
 
-    def _make_request(self, url, params={}, tries=0):
-
-        try:
-            response = self.requester.get(BGGClient.BASE_URL + url, params=params)
-        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
-            if tries < 3:
-                time.sleep(2)
-                return self._make_request(url, params=params, tries=tries + 1)
-
-            raise BGGException("BGG API closed the connection prematurely, please try again...")
+    def iter_game_list(self, game_ids):
+        """
+        Yield the games one chunk at a time, as soon as each chunk is downloaded, while the next
+        few chunks are prefetched. Games found in the game cache come first, in a single chunk.
+        """
+        game_ids, id_to_game, missing_ids = self._games_to_fetch(game_ids)
+        if id_to_game:
+            yield [id_to_game[id_] for id_ in game_ids if id_ in id_to_game]
+
+        chunks = iter(game_id_chunks(missing_ids))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = deque(
+                executor.submit(self._game_list_chunk, chunk)
+                for chunk in itertools.islice(chunks, self.max_workers)
+            )
+            try:
+                while in_flight:
+                    games = in_flight.popleft().result()
+                    for chunk in itertools.islice(chunks, 1):
+                        in_flight.append(executor.submit(self._game_list_chunk, chunk))
+
+                    self._store_games(games)
+                    yield games
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def _game_list_chunk(self, game_ids):
+        data = self._make_request(thing_url(game_ids))
+        return self._games_list_to_games(data)
+
+    def _make_request(self, url, params={}):
+        for tries in range(BGGClient.MAX_TRIES):
+            # Responses that requests_cache has on disk never reach BGG, so they don't need to wait their turn
+            if not self._is_cached(url, params):
+                self.rate_limiter.wait()
+
+            started_at = time.time()
+            try:
+                response = self.requester.get(BGGClient.BASE_URL + url, params=params)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                error, delay = self._connection_failed(BGGClient.BASE_URL + url, tries, started_at, e)
+                time.sleep(delay)
+                continue
+
+            text, error, delay = self._handle_response(response, tries, started_at)
+            if text is not None:
+                return text
+
+            time.sleep(delay)
+
+        raise BGGException(f"{error} (gave up after {BGGClient.MAX_TRIES} tries)")
+
+    def _is_cached(self, url, params):
+        if not self.cache:
+            return False
+
+        request = requests.Request("GET", BGGClient.BASE_URL + url, params=params)
+        return self.cache.is_fresh(self.cache.cache.prepare_request(request))
+
+    def _connection_failed(self, url, tries, started_at, e):
+        self._trace(started_at, url, tries, error=type(e).__name__)
+        error = "BGG API closed the connection prematurely, please try again..."
+        delay = self.rate_limiter.backoff(tries)
+        logger.debug(f"{error} Waiting {delay:.1f} seconds before trying again...")
+        return error, delay
+
+    def _handle_response(self, response, tries, started_at):
+        """
+        Returns (text, None, None) for a successful response, and (None, error, delay) for one
+        that should be retried after sleeping for delay seconds. Raises BGGException for errors
+        that retrying won't fix.
+        """
+        url = str(response.url)
+        self._trace(started_at, url, tries, response=response)
+
+        # Prettifying multi-megabyte responses is slow, only do it when it will be printed
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("REQUEST: " + url)
+            logger.debug("RESPONSE: \n" + prettify_if_xml(response.text))
+
+        if response.status_code in BGGClient.RETRY_STATUS_CODES:
+            error = f"BGG returned status code {response.status_code} when requesting {url}"
+            delay = self.rate_limiter.backoff(tries, retry_after=parse_retry_after(response))
+
+            # 202 Accepted means this request is queued, while the others mean BGG is
+            # overloaded. Pause every request in that case, not just this one.
+            if response.status_code == 202:
+                return None, error, delay
 
-        logger.debug("REQUEST: " + response.url)
-        logger.debug("RESPONSE: \n" + prettify_if_xml(response.text))
+            logger.debug(f"{error}, waiting {delay:.1f} seconds before trying again...")
+            self.rate_limiter.pause(delay)
+            return None, error, 0
 
         if response.status_code != 200:
-
-            # Handle 202 Accepted
-            if response.status_code == 202:
-                if tries < 10:
-                    time.sleep(5)
-                    return self._make_request(url, params=params, tries=tries + 1)
-
-            # Handle 504 Gateway Timeout
-            if response.status_code == 540:
-                if tries < 3:
-                    time.sleep(2)
-                    return self._make_request(url, params=params, tries=tries + 1)
-
-            # Handle 429 Too Many Requests
-            if response.status_code == 429:
-                if tries < 3:
-                    logger.debug("BGG returned \"Too Many Requests\", waiting 30 seconds before trying again...")
-                    time.sleep(30)
-                    return self._make_request(url, params=params, tries=tries + 1)
-
             raise BGGException(
-                f"BGG returned status code {response.status_code} when requesting {response.url}"
+                f"BGG returned status code {response.status_code} when requesting {url}"
             )
 
-        tree = fromstring(response.text)
-        if tree.tag == "errors":
+        # The converters parse the response anyway, so only look at the root tag here,
+        # and only parse the whole document when there are errors to report
+        if root_tag(response.text) == "errors":
+            tree = fromstring(response.text)
             raise BGGException(
-                f"BGG returned errors while requesting {response.url} - " +
+                f"BGG returned errors while requesting {url} - " +
                 str([subnode.text for node in tree for subnode in node])
             )
 
-        return response.text
+        return response.text, None, None
+
+    def _trace(self, started_at, url, tries, response=None, error=None):
+        if not self.tracer:
+            return
+
+        self.tracer.record({
+            "time": round(started_at, 3),
+            "url": url,
+            "status": response.status_code if response is not None else None,
+            "bytes": len(response.content) if response is not None else 0,
+            "latency": round(time.time() - started_at, 3),
+            "retries": tries,
+            "from_cache": getattr(response, "from_cache", False),
+            "error": error,
+        })
 
     def _plays_to_games(self, data):
         def after_players_hook(_, status):
             return status["name"] if "name" in status else "Unknown"
 
         plays_processor = xml.dictionary("plays", [
+            xml.integer(".", attribute="total", required=False),
             xml.array(
                 xml.dictionary('play', [
                     xml.integer(".", attribute="id", alias="playid"),
+                    xml.string(".", attribute="date", required=False),
                     xml.dictionary('item', [
                         xml.string(".", attribute="name", alias="gamename"),
                         xml.integer(".", attribute="objectid", alias="gameid")
@@ -133,8 +307,7 @@ class BGGClient:
         ])
 
         plays = xml.parse_from_string(plays_processor, data)
-        plays = plays["plays"]
-        return plays
+        return plays["total"], plays["plays"]
 
     def _collection_to_games(self, data):
         def after_status_hook(_, status):
@@ -166,36 +339,102 @@ class BGGClient:
         return collection
 
     def _games_list_to_games(self, data):
-        def numplayers_to_result(_, results):
-            result = {result["value"].lower().replace(" ", "_"): int(result["numvotes"]) for result in results}
-
-            if not result:
-                result = {'best': 0, 'recommended': 0, 'not_recommended': 0}
-
-            is_recommended = result['best'] + result['recommended'] > result['not_recommended']
-            if not is_recommended:
-                return "not_recommended"
-
-            is_best = result['best'] > 10 and result['best'] > result['recommended']
-            if is_best:
-                return "best"
-
-            return "recommended"
-
-        def suggested_numplayers(_, numplayers):
-            # Remove not_recommended player counts
-            numplayers = [players for players in numplayers if players["result"] != "not_recommended"]
-
-            # If there's only one player count, that's the best one
-            if len(numplayers) == 1:
-                numplayers[0]["result"] = "best"
-
-            # Just return the numbers
-            return [
-                (players["numplayers"], players["result"])
-                for players in numplayers
-            ]
+        if self.parser == "fast":
+            return self._games_list_to_games_fast(data)
+
+        return self._games_list_to_games_declxml(data)
+
+    def _games_list_to_games_fast(self, data):
+        # Walks the children of each item exactly once, instead of letting declxml
+        # search all children again for every field. Builds the same dicts.
+        return [self._item_to_game(item) for item in fromstring(data) if item.tag == "item"]
+
+    def _item_to_game(self, item):
+        game = {
+            "id": int(item.get("id")),
+            "type": item.get("type", "").strip(),
+            "name": None,
+            "description": None,
+            "categories": [],
+            "mechanics": [],
+            "expansions": [],
+            "suggested_numplayers": None,
+            "weight": None,
+            "rank": "",
+            "usersrated": None,
+            "numowned": None,
+            "rating": None,
+            "playing_time": None,
+        }
 
+        for child in item:
+            if child.tag == "name":
+                if game["name"] is None and child.get("type") == "primary":
+                    game["name"] = child.get("value")
+            elif child.tag == "description":
+                if game["description"] is None:
+                    game["description"] = child.text or ""
+            elif child.tag == "link":
+                link_type = child.get("type")
+                if link_type == "boardgamecategory":
+                    game["categories"].append(child.get("value", "").strip())
+                elif link_type == "boardgamemechanic":
+                    game["mechanics"].append(child.get("value", "").strip())
+                elif link_type == "boardgameexpansion":
+                    game["expansions"].append({
+                        "id": int(child.get("id")),
+                        "inbound": parse_boolean(child.get("inbound", "false")),
+                    })
+            elif child.tag == "poll":
+                if child.get("name") == "suggested_numplayers" and child.find("results") is not None:
+                    game["suggested_numplayers"] = [
+                        {
+                            "numplayers": results.get("numplayers").strip(),
+                            "result": numplayers_to_result([
+                                {"value": result.get("value").strip(), "numvotes": int(result.get("numvotes"))}
+                                for result in results if result.tag == "result"
+                            ]),
+                        }
+                        for results in child if results.tag == "results"
+                    ]
+            elif child.tag == "playingtime":
+                if game["playing_time"] is None:
+                    game["playing_time"] = child.get("value")
+            elif child.tag == "statistics":
+                ratings = child.find("ratings")
+                if ratings is not None:
+                    self._ratings_to_game(ratings, game)
+
+        missing = [key for key, value in game.items() if value is None]
+        if missing:
+            raise BGGException(f"BGG returned a game without {', '.join(missing)} (id: {game['id']})")
+
+        for key in ("name", "description", "weight", "usersrated", "numowned", "rating", "playing_time"):
+            game[key] = game[key].strip()
+
+        game["suggested_numplayers"] = suggested_numplayers(game["suggested_numplayers"])
+
+        logger.debug("Successfully parsed: {} (id: {}).".format(game["name"], game["id"]))
+        return game
+
+    def _ratings_to_game(self, ratings, game):
+        ratings_aliases = {
+            "averageweight": "weight",
+            "usersrated": "usersrated",
+            "owned": "numowned",
+            "bayesaverage": "rating",
+        }
+        for child in ratings:
+            alias = ratings_aliases.get(child.tag)
+            if alias and game[alias] is None:
+                game[alias] = child.get("value")
+            elif child.tag == "ranks" and game["rank"] == "":
+                for rank in child:
+                    if rank.tag == "rank" and rank.get("friendlyname") == "Board Game Rank":
+                        game["rank"] = rank.get("value", "").strip()
+                        break
+
+    def _games_list_to_games_declxml(self, data):
         def log_item(_, item):
             logger.debug("Successfully parsed: {} (id: {}).".format(item["name"], item["id"]))
             return item
@@ -243,11 +482,11 @@ class BGGClient:
                                         xml.string(".", attribute="value"),
                                         xml.integer(".", attribute="numvotes"),
                                     ], required=False),
-                                    hooks=xml.Hooks(after_parse=numplayers_to_result)
+                                    hooks=xml.Hooks(after_parse=lambda _, results: numplayers_to_result(results))
                                 )
                             ]),
                             alias="suggested_numplayers",
-                            hooks=xml.Hooks(after_parse=suggested_numplayers),
+                            hooks=xml.Hooks(after_parse=lambda _, numplayers: suggested_numplayers(numplayers)),
                         ),
                         xml.string(
                             "statistics/ratings/averageweight",
@@ -287,23 +526,494 @@ class BGGClient:
         games = games["items"]
         return games
 
+class AsyncBGGClient(BGGClient):
+    """
+    An asyncio variant of BGGClient, where collection(), plays(), iter_plays() and game_list() are
+    coroutines. Every request goes through one pool of keep-alive connections, and is paced and
+    retried just like BGGClient's. Responses aren't cached, since requests_cache only works with
+    requests, but the game cache is.
+    """
+
+    def __init__(self, debug=False, max_workers=4, requests_per_second=2, rate_limiter=None,
+                 parser="fast", tracer=None, game_cache=None, checkpoint=None, timeout=60):
+        super().__init__(
+            debug=debug,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+            rate_limiter=rate_limiter,
+            parser=parser,
+            tracer=tracer,
+            game_cache=game_cache,
+            checkpoint=checkpoint,
+            requester=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+                timeout=timeout,
+            ),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.requester.aclose()
+
+    async def collection(self, user_name, **kwargs):
+        data = await self._make_request("/collection?version=1", user_params(user_name, kwargs))
+        collection = self._collection_to_games(data)
+        return collection
+
+    async def plays(self, user_name):
+        return [play async for plays in self.iter_plays(user_name) for play in plays]
+
+    async def iter_plays(self, user_name, **kwargs):
+        """
+        Yield the plays of a user one page at a time, newest first, prefetching the pages
+        after the first one just like BGGClient.iter_plays does.
+        """
+        params = user_params(user_name, kwargs)
+
+        total, plays = await self._plays_page(params, page=1)
+        if not plays:
+            return
+
+        yield plays
+
+        if total is None:
+            # Without a total we can't prefetch, walk the pages until an empty one
+            page = 2
+            _, plays = await self._plays_page(params, page=page)
+            while plays:
+                yield plays
+                page += 1
+                _, plays = await self._plays_page(params, page=page)
+            return
+
+        pages = remaining_plays_pages(total)
+        in_flight = deque(
+            asyncio.ensure_future(self._plays_page(params, page=page))
+            for page in itertools.islice(pages, self.max_workers)
+        )
+        try:
+            while in_flight:
+                _, plays = await in_flight.popleft()
+                for page in itertools.islice(pages, 1):
+                    in_flight.append(asyncio.ensure_future(self._plays_page(params, page=page)))
+
+                if plays:
+                    yield plays
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def _plays_page(self, params, page):
+        data = await self._make_request("/plays?version=1", dict(params, page=page))
+        return self._plays_to_games(data)
+
+    async def game_list(self, game_ids):
+        game_ids, id_to_game, missing_ids = self._games_to_fetch(game_ids)
+        return self._merge_fetched_games(game_ids, id_to_game, await self._game_list_fetch(missing_ids))
+
+    async def _game_list_fetch(self, game_ids):
+        # Keep as many chunks in flight as BGGClient does, gather() returns them in input order
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def fetch_chunk(chunk):
+            async with semaphore:
+                games = await self._game_list_chunk(chunk)
+
+            # Store each chunk as soon as it arrives, so that an interrupted run loses as little as possible
+            self._store_games(games)
+            return games
+
+        chunk_games = await asyncio.gather(*[fetch_chunk(chunk) for chunk in game_id_chunks(game_ids)])
+        return [game for games in chunk_games for game in games]
+
+    async def _game_list_chunk(self, game_ids):
+        data = await self._make_request(thing_url(game_ids))
+        return self._games_list_to_games(data)
+
+    async def _make_request(self, url, params={}):
+        for tries in range(BGGClient.MAX_TRIES):
+            await self.rate_limiter.wait_async()
+            started_at = time.time()
+            try:
+                # Merging in empty params would re-encode the commas between game ids
+                response = await self.requester.get(BGGClient.BASE_URL + url, params=params or None)
+            except httpx.TransportError as e:
+                error, delay = self._connection_failed(BGGClient.BASE_URL + url, tries, started_at, e)
+                await asyncio.sleep(delay)
+                continue
+
+            text, error, delay = self._handle_response(response, tries, started_at)
+            if text is not None:
+                return text
+
+            await asyncio.sleep(delay)
+
+        raise BGGException(f"{error} (gave up after {BGGClient.MAX_TRIES} tries)")
+
+class RateLimiter:
+    """Token bucket pacing and backoff shared by every request made to BGG."""
+
+    def __init__(self, requests_per_second, burst=1, backoff_base=2, backoff_max=60):
+        self.rate = requests_per_second
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+
+    def wait(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _reserve(self):
+        # Take a token while holding the lock, going into debt if the bucket is
+        # empty, and sleep outside of it until the debt is paid back
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0, self.paused_until - now)
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                self.tokens -= 1
+                delay = max(delay, -self.tokens / self.rate)
+
+        return delay
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff(self, tries, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+
+        # Exponential backoff with jitter, so that parallel requests don't retry in lockstep
+        delay = min(self.backoff_max, self.backoff_base * 2 ** tries)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+class RequestTracer:
+    """Appends one JSON line per request made to BGG, with its status, size and latency."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, "a")
+
+    def record(self, trace):
+        line = json.dumps(trace)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
 class CacheBackendSqlite:
-    def __init__(self, path, ttl):
+    def __init__(self, path, ttl, max_size=100 * 1024 * 1024):
+        self.backend = BoundedSqliteCache(path, ttl=ttl, max_size=max_size)
         self.cache = CachedSession(
-            cache_name=path,
-            backend="sqlite",
+            backend=self.backend,
             expire_after=ttl,
-            extension="",
-            fast_save=True,
             allowable_codes=(200,)
         )
 
+    def is_fresh(self, request):
+        # Looks the response up without loading it, or counting it as a hit or a miss
+        key = self.backend.create_key(request)
+        return self.backend.responses.is_fresh(key, created_after=time.time() - self.backend.ttl.total_seconds())
+
+    def compact(self):
+        self.backend.responses.compact(created_before=time.time() - self.backend.ttl.total_seconds())
+
+    def stats(self):
+        return {
+            "hits": self.backend.hits,
+            "misses": self.backend.misses,
+            "evictions": self.backend.responses.evictions,
+            "bytes_read": self.backend.responses.bytes_read,
+            "bytes_written": self.backend.responses.bytes_written,
+            "size": self.backend.responses.size,
+        }
+
+class BoundedSqliteCache(BaseCache):
+    """requests_cache backend that stores compressed responses, and evicts the least recently used ones."""
+
+    def __init__(self, path, ttl, max_size):
+        super().__init__()
+        self.ttl = timedelta(seconds=ttl)
+        self.responses = CompressedLRUDict(path, max_size)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_response_and_time(self, key, default=(None, None)):
+        response, timestamp = super().get_response_and_time(key, default=default)
+        is_hit = response is not None and datetime.utcnow() - timestamp <= self.ttl
+        with self.lock:
+            if is_hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return response, timestamp
+
+class CompressedLRUDict(MutableMapping):
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+        self.evictions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            # Uncompressed responses stored by earlier versions of the cache
+            self.connection.execute("DROP TABLE IF EXISTS responses")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS compressed_responses (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS compressed_responses_accessed_at ON compressed_responses (accessed_at)"
+            )
+
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM compressed_responses").fetchone()[0]
+
+    def __getitem__(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM compressed_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE compressed_responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+                )
+            self.bytes_read += len(row[0])
+
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def __setitem__(self, key, value):
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT size FROM compressed_responses WHERE key = ?", (key,)).fetchone()
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO compressed_responses VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data), now, now),
+                )
+            self.size += len(data) - (row[0] if row else 0)
+            self.bytes_written += len(data)
+
+            if self.size > self.max_size:
+                self._evict()
+
+    def __delitem__(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT size FROM compressed_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+
+            with self.connection:
+                self.connection.execute("DELETE FROM compressed_responses WHERE key = ?", (key,))
+            self.size -= row[0]
+
+    def __contains__(self, key):
+        with self.lock:
+            query = "SELECT 1 FROM compressed_responses WHERE key = ?"
+            return self.connection.execute(query, (key,)).fetchone() is not None
+
+    def is_fresh(self, key, created_after):
+        with self.lock:
+            query = "SELECT 1 FROM compressed_responses WHERE key = ? AND created_at > ?"
+            return self.connection.execute(query, (key, created_after)).fetchone() is not None
+
+    def __iter__(self):
+        with self.lock:
+            keys = [row[0] for row in self.connection.execute("SELECT key FROM compressed_responses")]
+
+        return iter(keys)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM compressed_responses").fetchone()[0]
+
+    def _evict(self):
+        # Evict down to 90% of the limit, so that the following saves don't have to evict again
+        target_size = self.max_size * 0.9
+        evicted_keys = []
+        for key, size in self.connection.execute("SELECT key, size FROM compressed_responses ORDER BY accessed_at"):
+            if self.size <= target_size:
+                break
+
+            evicted_keys.append((key,))
+            self.size -= size
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM compressed_responses WHERE key = ?", evicted_keys)
+        self.evictions += len(evicted_keys)
+
+    def compact(self, created_before):
+        with self.lock:
+            with self.connection:
+                self.connection.execute("DELETE FROM compressed_responses WHERE created_at < ?", (created_before,))
+
+            # VACUUM rebuilds the file, which is the only way to give free pages back to the file system
+            self.connection.execute("VACUUM")
+            self.size = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM compressed_responses"
+            ).fetchone()[0]
+
+class GameCacheSqlite:
+    """
+    Caches parsed /thing records one game at a time, so that adding a game to a
+    collection doesn't invalidate the cached data of the other 99 games in its chunk.
+
+    Rank and ratings change daily, and BGG returns them in the same response as
+    everything else, so a whole game expires after a single TTL.
+    """
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            # Files written before games were cached as a whole are just a cache, start over
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(games)")]
+            if "static" in columns:
+                self.connection.execute("DROP TABLE games")
+
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS games (
+                    id INTEGER PRIMARY KEY,
+                    game TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def get_many(self, game_ids):
+        now = time.time()
+        id_to_game = {}
+
+        # Stay well below SQLite's limit on the number of variables in a query
+        for i in range(0, len(game_ids), 500):
+            chunk = game_ids[i:i + 500]
+            rows = self.connection.execute(
+                f"SELECT game FROM games WHERE id IN ({','.join('?' * len(chunk))}) AND updated_at > ?",
+                chunk + [now - self.ttl],
+            )
+            for (game,) in rows:
+                game = json.loads(game)
+                game["suggested_numplayers"] = [tuple(players) for players in game["suggested_numplayers"]]
+                id_to_game[game["id"]] = game
+
+        return id_to_game
+
+    def set_many(self, games):
+        now = time.time()
+        rows = [(game["id"], json.dumps(game), now) for game in games]
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO games VALUES (?, ?, ?)", rows)
+
+            # Expired games are never read again, and games that left the collection are never refreshed
+            self.connection.execute("DELETE FROM games WHERE updated_at <= ?", (now - self.ttl,))
+
 class BGGException(Exception):
     pass
 
+def user_params(user_name, kwargs):
+    params = kwargs.copy()
+    params["username"] = user_name
+    return params
+
+def remaining_plays_pages(total):
+    # The first page tells how many plays there are, the rest can then be fetched in any order
+    num_pages = math.ceil(total / BGGClient.PLAYS_PER_PAGE)
+    return iter(range(2, num_pages + 1))
+
+def game_id_chunks(game_ids):
+    # Split game_ids into smaller chunks to avoid "414 URI too long"
+    return [game_ids[i:i + 100] for i in range(0, len(game_ids), 100)]
+
+def thing_url(game_ids):
+    return "/thing/?stats=1&id=" + ",".join([str(id_) for id_ in game_ids])
+
+def numplayers_to_result(results):
+    result = {result["value"].lower().replace(" ", "_"): int(result["numvotes"]) for result in results}
+
+    if not result:
+        result = {'best': 0, 'recommended': 0, 'not_recommended': 0}
+
+    is_recommended = result['best'] + result['recommended'] > result['not_recommended']
+    if not is_recommended:
+        return "not_recommended"
+
+    is_best = result['best'] > 10 and result['best'] > result['recommended']
+    if is_best:
+        return "best"
+
+    return "recommended"
+
+def suggested_numplayers(numplayers):
+    # Remove not_recommended player counts
+    numplayers = [players for players in numplayers if players["result"] != "not_recommended"]
+
+    # If there's only one player count, that's the best one
+    if len(numplayers) == 1:
+        numplayers[0]["result"] = "best"
+
+    # Just return the numbers
+    return [
+        (players["numplayers"], players["result"])
+        for players in numplayers
+    ]
+
+def root_tag(xml_string):
+    # Skips the XML declaration, comments and doctype before the root element
+    match = re.search(r"<([^?!][^\s/>]*)", xml_string)
+    return match.group(1) if match else None
+
+def parse_boolean(value):
+    if value.lower() not in ("true", "false"):
+        raise BGGException(f"Invalid boolean value \"{value}\"")
+
+    return value.lower() == "true"
+
+def parse_retry_after(response):
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+
+    # Retry-After is either a number of seconds or an HTTP date
+    if retry_after.isdigit():
+        return int(retry_after)
+
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
 def prettify_if_xml(xml_string):
     import xml.dom.minidom
-    import re
     xml_string = re.sub(r"\s+<", "<", re.sub(r">\s+", ">", re.sub(r"\s+", " ", xml_string)))
     if not xml_string.startswith("<?xml"):
         return xml_string
@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+class Checkpoint:
+    """
+    Records the progress of a run as it goes: the games downloaded from BGG one chunk at a time,
+    the records built from them, and the records that have been uploaded. When a run with the
+    same settings is resumed, it picks up the completed work instead of doing it all over again.
+
+    The checkpoint is removed once a run completes, so it only ever holds an unfinished run.
+    """
+
+    def __init__(self, path, run_key, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+
+        # Without resume, or when the settings have changed, start over from scratch
+        run_key = json.dumps(run_key, sort_keys=True)
+        if os.path.exists(path) and (not resume or self._stored_run_key(path) != run_key):
+            os.remove(path)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS run (run_key TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, game TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS records (
+                    index_name TEXT NOT NULL,
+                    object_id TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (index_name, object_id)
+                );
+                CREATE TABLE IF NOT EXISTS uploads (
+                    index_name TEXT NOT NULL,
+                    object_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    PRIMARY KEY (index_name, object_id)
+                );
+            """)
+            if not self.connection.execute("SELECT run_key FROM run").fetchone():
+                self.connection.execute("INSERT INTO run VALUES (?)", (run_key,))
+
+    @staticmethod
+    def _stored_run_key(path):
+        try:
+            connection = sqlite3.connect(path)
+            try:
+                row = connection.execute("SELECT run_key FROM run").fetchone()
+            finally:
+                connection.close()
+        except sqlite3.DatabaseError:
+            return None
+
+        return row[0] if row else None
+
+    def get_many(self, game_ids):
+        # Same interface as GameCacheSqlite, so that BGGClient can treat them alike
+        id_to_game = {}
+        with self.lock:
+            for i in range(0, len(game_ids), 500):
+                chunk = game_ids[i:i + 500]
+                rows = self.connection.execute(
+                    f"SELECT game FROM games WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for (game,) in rows:
+                    game = json.loads(game)
+                    game["suggested_numplayers"] = [tuple(players) for players in game["suggested_numplayers"]]
+                    id_to_game[game["id"]] = game
+
+        return id_to_game
+
+    def set_many(self, games):
+        rows = [(game["id"], json.dumps(game)) for game in games]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO games VALUES (?, ?)", rows)
+
+    def records(self, index_name):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT object_id, record FROM records WHERE index_name = ?", (index_name,)
+            ).fetchall()
+
+        return {object_id: json.loads(record) for object_id, record in rows}
+
+    def set_records(self, index_name, records):
+        rows = [(index_name, record["objectID"], json.dumps(record, default=str)) for record in records]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?)", rows)
+
+    def uploads(self, index_name):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT object_id, hash FROM uploads WHERE index_name = ?", (index_name,)
+            ).fetchall()
+
+        return dict(rows)
+
+    def set_uploads(self, index_name, object_id_to_hash):
+        rows = [(index_name, object_id, hash_) for object_id, hash_ in object_id_to_hash.items()]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)", rows)
+
+    def remove(self):
+        with self.lock:
+            self.connection.close()
+            os.remove(self.path)
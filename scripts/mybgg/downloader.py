@@ -1,62 +1,157 @@
+import asyncio
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mybgg.bgg_client import AsyncBGGClient
 from mybgg.bgg_client import BGGClient
 from mybgg.bgg_client import CacheBackendSqlite
+from mybgg.bgg_client import GameCacheSqlite
+from mybgg.bgg_client import RequestTracer
+from mybgg.files import atomic_write
 from mybgg.models import BoardGame
 
 
 class Downloader():
-    def __init__(self, project_name, cache_bgg, debug=False):
-        if cache_bgg:
-            self.client = BGGClient(
-                cache=CacheBackendSqlite(
-                    path=f"{project_name}-cache.sqlite",
-                    ttl=60 * 60 * 24,
-                ),
-                debug=debug,
+    def __init__(self, project_name, cache_bgg, debug=False, max_workers=4, requests_per_second=2,
+                 incremental_plays=False, trace_path=None, cache_games=False, cache_max_size=100 * 1024 * 1024,
+                 use_async=False, checkpoint=None):
+        self.max_workers = max_workers
+        self.use_async = use_async
+        self.plays_state_path = f"{project_name}-plays.json" if incremental_plays else None
+        self.plays_state_lock = threading.Lock()
+        self.tracer = RequestTracer(trace_path) if trace_path else None
+        game_cache = None
+        if cache_games:
+            game_cache = GameCacheSqlite(
+                path=f"{project_name}-games.sqlite",
+                ttl=60 * 60 * 24,
             )
-        else:
-            self.client = BGGClient(
-                debug=debug,
+
+        self.cache = None
+        if cache_bgg:
+            self.cache = CacheBackendSqlite(
+                path=f"{project_name}-cache.sqlite",
+                ttl=60 * 60 * 24,
+                max_size=cache_max_size,
             )
 
+        self.client = BGGClient(
+            cache=self.cache,
+            debug=debug,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+            tracer=self.tracer,
+            game_cache=game_cache,
+            checkpoint=checkpoint,
+        )
+
+        # The async client is bound to the event loop it runs in, so it's created for each run.
+        # It shares the rate limiter, so that both clients together stay within BGG's limits.
+        self.async_client_options = {
+            "debug": debug,
+            "max_workers": max_workers,
+            "rate_limiter": self.client.rate_limiter,
+            "tracer": self.tracer,
+            "game_cache": game_cache,
+            "checkpoint": checkpoint,
+        }
+
     def collection(self, user_name, extra_params):
+        return self.collections([(user_name, extra_params)])[0]
+
+    def collections(self, users):
+        """
+        Downloads the collections of several (user_name, extra_params) pairs at once. Games that
+        are in more than one collection are only fetched once, and a list of games is returned
+        for each pair, in the same order.
+        """
+        if self.use_async:
+            return asyncio.run(self._collections_async(users))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Plays don't depend on anything else, so fetch them while everything else is downloading
+            players_futures = [executor.submit(self.players, user_name) for user_name, _ in users]
+            collections_data = list(executor.map(lambda user: self._collection_data(*user), users))
+            game_list_data = self.client.game_list(unique_game_ids(collections_data))
+            users_players = [future.result() for future in players_futures]
+
+        return self._join(collections_data, game_list_data, users_players)
+
+    async def _collections_async(self, users):
+        async with AsyncBGGClient(**self.async_client_options) as client:
+            # Plays don't depend on anything else, so fetch them while everything else is downloading
+            players_task = asyncio.gather(*[self._players_async(client, user_name) for user_name, _ in users])
+            try:
+                collections_data = await asyncio.gather(*[
+                    self._collection_data_async(client, user_name, extra_params)
+                    for user_name, extra_params in users
+                ])
+                game_list_data = await client.game_list(unique_game_ids(collections_data))
+            except BaseException:
+                players_task.cancel()
+                raise
+
+            users_players = await players_task
+
+        return self._join(collections_data, game_list_data, users_players)
+
+    def _join(self, collections_data, game_list_data, users_players):
+        game_id_to_data = {game["id"]: game for game in game_list_data}
+        return [
+            self._games(collection_data, game_id_to_data, game_id_to_players)
+            for collection_data, game_id_to_players in zip(collections_data, users_players)
+        ]
+
+    def _collection_data(self, user_name, extra_params):
+        if not isinstance(extra_params, list):
+            return self.client.collection(
+                user_name=user_name,
+                **extra_params,
+            )
+
         collection_data = []
-        plays_data = []
-
-        if isinstance(extra_params, list):
-            for params in extra_params:
-                collection_data += self.client.collection(
-                    user_name=user_name,
-                    **params,
-                )
-        else:
-            collection_data = self.client.collection(
+        for params in extra_params:
+            collection_data += self.client.collection(
+                user_name=user_name,
+                **params,
+            )
+
+        return collection_data
+
+    async def _collection_data_async(self, client, user_name, extra_params):
+        if not isinstance(extra_params, list):
+            return await client.collection(
                 user_name=user_name,
                 **extra_params,
             )
 
-        plays_data = self.client.plays(
-            user_name=user_name,
-        )
+        collections_data = await asyncio.gather(*[
+            client.collection(user_name=user_name, **params)
+            for params in extra_params
+        ])
+        return [game for collection_data in collections_data for game in collection_data]
 
-        game_list_data = self.client.game_list([game_in_collection["id"] for game_in_collection in collection_data])
+    def _games(self, collection_data, game_id_to_data, game_id_to_players):
         game_id_to_tags = {game["id"]: game["tags"] for game in collection_data}
         game_id_to_image = {game["id"]: game["image_version"] or game["image"] for game in collection_data}
         game_id_to_numplays = {game["id"]: game["numplays"] for game in collection_data}
 
-        game_id_to_players = {game["id"]: [] for game in collection_data}
-        for play in plays_data:
-            if play["game"]["gameid"] in game_id_to_players:
-                game_id_to_players[play["game"]["gameid"]].extend(play["players"])
-                game_id_to_players[play["game"]["gameid"]] = list(set(game_id_to_players[play["game"]["gameid"]]))
-
-        games_data = list(filter(lambda x: x["type"] == "boardgame", game_list_data))
-        expansions_data = list(filter(lambda x: x["type"] == "boardgameexpansion", game_list_data))
+        game_list_data = [game_id_to_data[game_id] for game_id in game_id_to_tags if game_id in game_id_to_data]
+        games_data = [game for game in game_list_data if game["type"] == "boardgame"]
+        expansions_data = [game for game in game_list_data if game["type"] == "boardgameexpansion"]
 
+        # Expansions can expand several games in the collection, so only build each of them once
         game_id_to_expansion = {game["id"]: [] for game in games_data}
         for expansion_data in expansions_data:
+            expansion_game = None
             for expansion in expansion_data["expansions"]:
                 if expansion["inbound"] and expansion["id"] in game_id_to_expansion:
-                    game_id_to_expansion[expansion["id"]].append(expansion_data)
+                    if expansion_game is None:
+                        expansion_game = BoardGame(expansion_data)
+                    game_id_to_expansion[expansion["id"]].append(expansion_game)
 
         games = [
             BoardGame(
@@ -64,12 +159,177 @@ class Downloader():
                 image=game_id_to_image[game_data["id"]],
                 tags=game_id_to_tags[game_data["id"]],
                 numplays=game_id_to_numplays[game_data["id"]],
-                previous_players=game_id_to_players[game_data["id"]],
-                expansions=[
-                    BoardGame(expansion_data)
-                    for expansion_data in game_id_to_expansion[game_data["id"]]
-                ]
+                previous_players=sorted(game_id_to_players.get(game_data["id"], [])),
+                expansions=game_id_to_expansion[game_data["id"]],
             )
             for game_data in games_data
         ]
         return games
+
+    def iter_collection(self, user_name, extra_params):
+        """
+        Yields the games of a collection as soon as they can be built, while the rest are still
+        downloading. Games are only fetched as fast as they are consumed, a few chunks ahead.
+
+        A game is built once every expansion in the collection that it links to has arrived.
+        Should an expansion link to a game that has already been yielded, without the game
+        linking back, the game is yielded again with the expansion added.
+        """
+        collection_data = self._collection_data(user_name, extra_params)
+        game_id_to_tags = {game["id"]: game["tags"] for game in collection_data}
+        game_id_to_image = {game["id"]: game["image_version"] or game["image"] for game in collection_data}
+        game_id_to_numplays = {game["id"]: game["numplays"] for game in collection_data}
+
+        fetched_ids = set()
+        game_id_to_data = {}
+        game_id_to_expansion = {}
+        waiting_ids = {}
+        yielded_ids = set()
+
+        def build(game_data):
+            return BoardGame(
+                game_data,
+                image=game_id_to_image[game_data["id"]],
+                tags=game_id_to_tags[game_data["id"]],
+                numplays=game_id_to_numplays[game_data["id"]],
+                previous_players=sorted(game_id_to_players.get(game_data["id"], [])),
+                expansions=game_id_to_expansion.get(game_data["id"], []),
+            )
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Plays are needed for every game, so fetch them while the first games are downloading
+            players_future = executor.submit(self.players, user_name)
+            game_id_to_players = None
+
+            for games_data in self.client.iter_game_list(list(game_id_to_tags)):
+                regrown_ids = set()
+                for game_data in games_data:
+                    fetched_ids.add(game_data["id"])
+                    if game_data["type"] == "boardgame":
+                        game_id_to_data[game_data["id"]] = game_data
+                        waiting_ids[game_data["id"]] = {
+                            expansion["id"]
+                            for expansion in game_data["expansions"]
+                            if not expansion["inbound"] and expansion["id"] in game_id_to_tags
+                        }
+                    elif game_data["type"] == "boardgameexpansion":
+                        expansion_game = None
+                        for expansion in game_data["expansions"]:
+                            if expansion["inbound"] and expansion["id"] in game_id_to_tags:
+                                if expansion_game is None:
+                                    expansion_game = BoardGame(game_data)
+                                game_id_to_expansion.setdefault(expansion["id"], []).append(expansion_game)
+                                if expansion["id"] in yielded_ids:
+                                    regrown_ids.add(expansion["id"])
+
+                if game_id_to_players is None:
+                    game_id_to_players = players_future.result()
+
+                for game_id in regrown_ids:
+                    yield build(game_id_to_data[game_id])
+
+                ready_ids = [game_id for game_id, ids in waiting_ids.items() if ids <= fetched_ids]
+                for game_id in ready_ids:
+                    del waiting_ids[game_id]
+                    yielded_ids.add(game_id)
+                    yield build(game_id_to_data[game_id])
+
+            if game_id_to_players is None:
+                game_id_to_players = players_future.result()
+
+        # Expansions that BGG didn't return can't hold anything up at the end
+        for game_id in waiting_ids:
+            yield build(game_id_to_data[game_id])
+
+    def players(self, user_name):
+        game_id_to_players, last_play_date = self._start_plays_sync(user_name)
+
+        # Only the player names are needed, so consume the plays one page at a time
+        mindate = plays_mindate(last_play_date) if last_play_date else None
+        params = {"mindate": mindate} if mindate else {}
+        for plays in self.client.iter_plays(user_name=user_name, **params):
+            last_play_date = self._merge_plays(game_id_to_players, plays, last_play_date)
+
+        self._finish_plays_sync(user_name, game_id_to_players, last_play_date)
+        return game_id_to_players
+
+    async def _players_async(self, client, user_name):
+        game_id_to_players, last_play_date = self._start_plays_sync(user_name)
+
+        mindate = plays_mindate(last_play_date) if last_play_date else None
+        params = {"mindate": mindate} if mindate else {}
+        async for plays in client.iter_plays(user_name=user_name, **params):
+            last_play_date = self._merge_plays(game_id_to_players, plays, last_play_date)
+
+        self._finish_plays_sync(user_name, game_id_to_players, last_play_date)
+        return game_id_to_players
+
+    def _start_plays_sync(self, user_name):
+        # Plays never change once logged, so only ask for the ones since the last sync.
+        # See plays_mindate() for how far back that goes.
+        state = self._load_plays_state(user_name)
+        game_id_to_players = {int(game_id): set(players) for game_id, players in state["players"].items()}
+        return game_id_to_players, state["last_play_date"]
+
+    def _merge_plays(self, game_id_to_players, plays, last_play_date):
+        for play in plays:
+            game_id_to_players.setdefault(play["game"]["gameid"], set()).update(play["players"])
+            if play["date"] and (not last_play_date or play["date"] > last_play_date):
+                last_play_date = play["date"]
+
+        return last_play_date
+
+    def _finish_plays_sync(self, user_name, game_id_to_players, last_play_date):
+        if self.plays_state_path:
+            self._save_plays_state({
+                "user_name": user_name,
+                "last_play_date": last_play_date,
+                "players": {game_id: sorted(players) for game_id, players in game_id_to_players.items()},
+            })
+
+    def _load_plays_state(self, user_name):
+        empty_state = {"user_name": user_name, "last_play_date": None, "players": {}}
+        with self.plays_state_lock:
+            return self._read_plays_states().get(user_name, empty_state)
+
+    def _save_plays_state(self, state):
+        if not self.plays_state_path:
+            return
+
+        # Several users can be synced at once, so merge with what the others have written
+        with self.plays_state_lock:
+            states = self._read_plays_states()
+            states[state["user_name"]] = state
+            with atomic_write(self.plays_state_path) as f:
+                json.dump({"users": states}, f)
+
+    def _read_plays_states(self):
+        if not self.plays_state_path or not os.path.exists(self.plays_state_path):
+            return {}
+
+        with open(self.plays_state_path) as f:
+            data = json.load(f)
+
+        # Files written before batch mode hold the state of a single user
+        if "user_name" in data:
+            return {data["user_name"]: data}
+
+        return data["users"]
+
+def plays_mindate(last_play_date, lookback_days=30):
+    """
+    BGG filters plays by the date they were played, not the date they were logged, and plays
+    are often logged days after the fact. Looking back a while from the newest play catches
+    those, and the plays that are fetched again are harmless since players are merged into sets.
+    """
+    try:
+        last_date = datetime.date.fromisoformat(last_play_date)
+    except ValueError:
+        # BGG sometimes has odd dates like 0000-00-00, fall back to fetching every play
+        return None
+
+    return (last_date - datetime.timedelta(days=lookback_days)).isoformat()
+
+def unique_game_ids(collections_data):
+    # Popular games are in most collections, so fetch every game only once
+    return list(dict.fromkeys(game["id"] for collection_data in collections_data for game in collection_data))
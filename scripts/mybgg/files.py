@@ -0,0 +1,19 @@
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """
+    Opens a temporary file next to path for writing, and moves it over path once the block is
+    done. A crash halfway through leaves the previous file untouched instead of a half written one.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, path)
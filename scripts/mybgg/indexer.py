@@ -1,25 +1,54 @@
+import hashlib
 import io
+import itertools
+import json
+import multiprocessing
+import os
 import re
+import sqlite3
+import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import colorgram
+import numpy
 import requests
+from requests.adapters import HTTPAdapter
+from algoliasearch.exceptions import AlgoliaUnreachableHostException, RequestException
 from algoliasearch.search_client import SearchClient
 # Allow colorgram to read truncated files
 from PIL import Image, ImageFile
 
+from mybgg.files import atomic_write
+
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 class Indexer:
 
-    def __init__(self, app_id, apikey, index_name, hits_per_page):
-        client = SearchClient.create(
-            app_id=app_id,
-            api_key=apikey,
-        )
+    def __init__(self, app_id, apikey, index_name, hits_per_page, image_workers=8, color_cache=None,
+                 fast_colors=False, manifest=None, batch_size=500, force_settings=False, client=None,
+                 checkpoint=None):
+        self.image_workers = image_workers
+        self.batch_size = batch_size
+        self.manifest = manifest
+        self.checkpoint = checkpoint
+        self.fast_colors = fast_colors
+        self.color_cache = color_cache
+
+        # Reuse connections to the image host across all threads
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=image_workers))
+
+        if client is None:
+            client = SearchClient.create(
+                app_id=app_id,
+                api_key=apikey,
+            )
         index = client.init_index(index_name)
 
-        index.set_settings({
+        self.force_settings = force_settings
+        self._update_settings(index, {
             'searchableAttributes': [
                 'name',
                 'description',
@@ -37,6 +66,11 @@ class Indexer:
             'highlightPreTag': '<strong class="highlight">',
             'highlightPostTag': '</strong>',
             'hitsPerPage': hits_per_page,
+            'replicas': [
+                index.name + '_rank_ascending',
+                index.name + '_numrated_descending',
+                index.name + '_numowned_descending',
+            ],
         })
 
         self._init_replicas(client, index)
@@ -44,39 +78,34 @@ class Indexer:
         self.index = index
 
     def _init_replicas(self, client, mainIndex):
-
-        mainIndex.set_settings({
-            'replicas': [
-                mainIndex.name + '_rank_ascending',
-                mainIndex.name + '_numrated_descending',
-                mainIndex.name + '_numowned_descending',
-            ]
-        })
-
         replica_index = client.init_index(mainIndex.name + '_rank_ascending')
-        replica_index.set_settings({'ranking': ['asc(rank)']})
+        self._update_settings(replica_index, {'ranking': ['asc(rank)']})
 
         replica_index = client.init_index(mainIndex.name + '_numrated_descending')
-        replica_index.set_settings({'ranking': ['desc(usersrated)']})
+        self._update_settings(replica_index, {'ranking': ['desc(usersrated)']})
 
         replica_index = client.init_index(mainIndex.name + '_numowned_descending')
-        replica_index.set_settings({'ranking': ['desc(numowned)']})
-
-    @staticmethod
-    def todict(obj):
-        if isinstance(obj, str):
-            return obj
-
-        elif isinstance(obj, dict):
-            return dict((key, Indexer.todict(val)) for key, val in obj.items())
-
-        elif hasattr(obj, '__iter__'):
-            return [Indexer.todict(val) for val in obj]
-
-        elif hasattr(obj, '__dict__'):
-            return Indexer.todict(vars(obj))
+        self._update_settings(replica_index, {'ranking': ['desc(numowned)']})
+
+    def _update_settings(self, index, settings):
+        # Every settings change makes algolia rebuild the index, so only send what differs
+        if not self.force_settings:
+            try:
+                current_settings = index.get_settings()
+            except RequestException as e:
+                if e.status_code != 404:
+                    raise
+
+                current_settings = {}
+
+            settings = {
+                key: value
+                for key, value in settings.items()
+                if current_settings.get(key) != value
+            }
 
-        return obj
+        if settings:
+            index.set_settings(settings)
 
     def _facet_for_num_player(self, num, type_):
         num_no_plus = num.replace("+", "")
@@ -152,50 +181,172 @@ class Indexer:
 
     def fetch_image(self, url, tries=0):
         try:
-            response = requests.get(url)
+            response = self.session.get(url)
         except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
             if tries < 3:
                 time.sleep(2)
                 return self.fetch_image(url, tries=tries + 1)
 
+            return None
+
         if response.status_code == 200:
             return response.content
 
         return None
 
-    def add_objects(self, collection):
-        games = [Indexer.todict(game) for game in collection]
-        for i, game in enumerate(games):
+    def _image_colors(self, image_urls):
+        # Images are fetched in a thread pool, and colors extracted in a process pool since
+        # colorgram is CPU bound pure Python. Colors are yielded in the same order as the urls,
+        # and only a limited number of images are in flight at once to keep memory flat.
+        color_pool = None
+        color_pool_lock = threading.Lock()
+
+        def get_color_pool():
+            # Only start processes once an image needs them, most colors come from the caches.
+            # Forking while other threads hold locks can deadlock the child, so spawn them instead,
+            # which also works on every platform.
+            nonlocal color_pool
+            with color_pool_lock:
+                if color_pool is None:
+                    color_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+
+                return color_pool
+
+        color_mode = "fast" if self.fast_colors else "full"
+
+        def image_color(image_url):
+            if not image_url:
+                return None
+
+            # BGG never changes the image behind an url, so a cached color is always valid
+            if self.color_cache:
+                color = self.color_cache.get(image_url, color_mode)
+                if color:
+                    return color
+
+            image_data = self.fetch_image(image_url)
+            if not image_data:
+                return None
+
+            color = get_color_pool().submit(pick_color, image_data, self.fast_colors).result()
+            if self.color_cache:
+                self.color_cache.set(image_url, color_mode, color)
+
+            return color
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.image_workers) as fetch_pool:
+                in_flight = deque()
+                for image_url in image_urls:
+                    in_flight.append(fetch_pool.submit(image_color, image_url))
+                    if len(in_flight) > 2 * self.image_workers:
+                        yield in_flight.popleft().result()
+
+                while in_flight:
+                    yield in_flight.popleft().result()
+        finally:
+            if color_pool is not None:
+                color_pool.shutdown()
+
+    def add_objects(self, collection, wait=False):
+        records = self._records(collection)
+
+        if self.manifest is not None:
+            records = (record for record in records if self.manifest.is_changed(record))
+
+        if self.checkpoint:
+            records = self._not_uploaded(records)
+
+        # Send records in batches as soon as they are ready, so that uploading overlaps
+        # with fetching images, and a failure late in the run doesn't lose everything.
+        # Uploads run in the background, with at most one batch waiting behind the one being
+        # sent, so that a slow upload holds back image fetching instead of piling up records.
+        responses = []
+        num_sent = 0
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            in_flight = deque()
+            for batch in chunks(records, self.batch_size):
+                if len(in_flight) == 2:
+                    num_sent += self._finish_batch(in_flight.popleft(), responses)
+
+                if self.checkpoint:
+                    self.checkpoint.set_records(self.index.name, batch)
+
+                in_flight.append((batch, executor.submit(self._save_batch, batch)))
+
+            while in_flight:
+                num_sent += self._finish_batch(in_flight.popleft(), responses)
+
+        if self.manifest is not None:
+            print(f"{num_sent} games were new or changed since the last run.")
+            self.manifest.save()
+
+        # Algolia processes batches asynchronously, only wait for them once everything is sent
+        if wait:
+            for response in responses:
+                response.wait()
+
+    def _finish_batch(self, batch_and_future, responses):
+        batch, future = batch_and_future
+        responses.append(future.result())
+        if self.manifest is not None:
+            self.manifest.update(batch)
+
+        if self.checkpoint:
+            self.checkpoint.set_uploads(
+                self.index.name,
+                {record["objectID"]: IndexManifest.record_hash(record) for record in batch},
+            )
+
+        return len(batch)
+
+    def _not_uploaded(self, records):
+        uploads = self.checkpoint.uploads(self.index.name)
+        for record in records:
+            if uploads.get(record["objectID"]) != IndexManifest.record_hash(record):
+                yield record
+
+            # Uploaded before the last run was interrupted, but never saved to the manifest
+            elif self.manifest is not None:
+                self.manifest.update([record])
+
+    def _save_batch(self, batch, tries=0):
+        try:
+            return self.index.save_objects(batch)
+        except (AlgoliaUnreachableHostException, RequestException) as e:
+            is_transient = not isinstance(e, RequestException) or e.status_code in (None, 429) or e.status_code >= 500
+            if is_transient and tries < 3:
+                time.sleep(2 ** tries)
+                return self._save_batch(batch, tries=tries + 1)
+
+            raise
+
+    def _records(self, collection):
+        # Records built before the last run was interrupted don't need their images again
+        checkpointed_records = self.checkpoint.records(self.index.name) if self.checkpoint else {}
+
+        # A streamed game can come again with more expansions, so only reuse a record once
+        def with_checkpointed_record(games):
+            for game in games:
+                yield game, checkpointed_records.pop(f"bgg{game.id}", None)
+
+        games, games_for_images = itertools.tee(with_checkpointed_record(collection))
+        colors = self._image_colors(None if record else game.image for game, record in games_for_images)
+
+        # Games can be streamed in while they are downloaded, and then there's no total yet
+        total = f" of {len(collection)}" if hasattr(collection, "__len__") else ""
+        for i, ((game, record), color) in enumerate(zip(games, colors)):
             if i != 0 and i % 25 == 0:
-                print(f"Indexed {i} of {len(games)} games...")
-
-            if game["image"]:
-                image_data = self.fetch_image(game["image"])
-                if image_data:
-                    image = Image.open(io.BytesIO(image_data)).convert('RGBA')
-
-                    try_colors = 10
-                    colors = colorgram.extract(image, try_colors)
-                    for i in range(min(try_colors, len(colors))):
-                        color_r, color_g, color_b = colors[i].rgb.r, colors[i].rgb.g, colors[i].rgb.b
-
-                        # Don't return very light or dark colors
-                        luma = (
-                            0.2126 * color_r / 255.0 +
-                            0.7152 * color_g / 255.0 +
-                            0.0722 * color_b / 255.0
-                        )
-                        if (
-                            luma > 0.2 and  # Not too dark
-                            luma < 0.8     # Not too light
-                        ):
-                            break
-
-                    else:
-                        # As a fallback, use the first color
-                        color_r, color_g, color_b = colors[0].rgb.r, colors[0].rgb.g, colors[0].rgb.b
-
-                    game["color"] = f"{color_r}, {color_g}, {color_b}"
+                print(f"Indexed {i}{total} games...")
+
+            if record:
+                yield record
+                continue
+
+            game = game.to_record()
+
+            if color:
+                game["color"] = color
 
             game["objectID"] = f"bgg{game['id']}"
 
@@ -223,10 +374,180 @@ class Indexer:
             # Make sure description is not too long
             game["description"] = self._prepare_description(game["description"])
 
-        self.index.save_objects(games)
+            yield game
 
     def delete_objects_not_in(self, collection):
-        delete_filter = " AND ".join([f"id != {game.id}" for game in collection])
-        self.index.delete_by({
-            'filters': delete_filter,
-        })
+        # The manifest only knows what earlier delta runs sent, so always ask the index what's there
+        existing_ids = [
+            hit["objectID"]
+            for hit in self.index.browse_objects({"attributesToRetrieve": ["objectID"]})
+        ]
+
+        object_ids = {f"bgg{game.id}" for game in collection}
+        vanished_ids = [object_id for object_id in existing_ids if object_id not in object_ids]
+
+        # delete_objects sends the ids to algolia in batches of 1000
+        if vanished_ids:
+            self.index.delete_objects(vanished_ids)
+
+        if self.manifest is not None:
+            self.manifest.remove(vanished_ids)
+            self.manifest.save()
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+class IndexManifest:
+    """
+    Content hashes of the records last sent to an index, so that only changed records are sent again.
+    An index is told apart by its name and its destination: an algolia app, or a local file.
+    """
+
+    def __init__(self, path, index_name, destination):
+        self.path = path
+        self.index_name = index_name
+        self.destination = destination
+        self.hashes = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+
+            if manifest.get("index_name") == index_name and manifest.get("destination") == destination:
+                self.hashes = manifest["hashes"]
+
+    @staticmethod
+    def record_hash(record):
+        return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def is_changed(self, record):
+        return self.hashes.get(record["objectID"]) != IndexManifest.record_hash(record)
+
+    def update(self, records):
+        for record in records:
+            self.hashes[record["objectID"]] = IndexManifest.record_hash(record)
+
+    def remove(self, object_ids):
+        for object_id in object_ids:
+            self.hashes.pop(object_id, None)
+
+    def save(self):
+        with atomic_write(self.path) as f:
+            json.dump({"index_name": self.index_name, "destination": self.destination, "hashes": self.hashes}, f)
+
+class ColorCacheSqlite:
+    """Colors picked from cover images, by url and by mode, since fast colors can differ from full size ones."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            # Colors cached before the mode was recorded can't be told apart, start over
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(colors)")]
+            if columns and "mode" not in columns:
+                self.connection.execute("DROP TABLE colors")
+
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS colors (
+                    url TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    color TEXT NOT NULL,
+                    PRIMARY KEY (url, mode)
+                )
+            """)
+
+    def get(self, url, mode):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT color FROM colors WHERE url = ? AND mode = ?", (url, mode)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def set(self, url, mode, color):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO colors VALUES (?, ?, ?)", (url, mode, color))
+
+def pick_color(image_data, fast=False):
+    image = Image.open(io.BytesIO(image_data))
+
+    try_colors = 10
+    if fast:
+        colors = extract_colors_fast(image, try_colors)
+    else:
+        colors = [color.rgb for color in colorgram.extract(image.convert('RGBA'), try_colors)]
+
+    for i in range(min(try_colors, len(colors))):
+        color_r, color_g, color_b = colors[i]
+
+        # Don't return very light or dark colors
+        luma = (
+            0.2126 * color_r / 255.0 +
+            0.7152 * color_g / 255.0 +
+            0.0722 * color_b / 255.0
+        )
+        if (
+            luma > 0.2 and  # Not too dark
+            luma < 0.8     # Not too light
+        ):
+            break
+
+    else:
+        # As a fallback, use the first color
+        color_r, color_g, color_b = colors[0]
+
+    return f"{color_r}, {color_g}, {color_b}"
+
+def extract_colors_fast(image, number_of_colors, size=64):
+    # Decoding a JPEG at a reduced scale with draft() is much faster than decoding it fully
+    image.draft("RGB", (size, size))
+    image = image.convert("RGB")
+    image.thumbnail((size, size))
+    return extract_colors(image, number_of_colors)
+
+def extract_colors(image, number_of_colors):
+    """
+    The same algorithm as colorgram.extract(), vectorized with numpy. Every pixel is put
+    in a bucket by the top two bits of its luminance, hue and lightness, and the average
+    color of the largest buckets is returned.
+    """
+    pixels = numpy.asarray(image.convert("RGB"), dtype=numpy.int64).reshape(-1, 3)
+    r, g, b = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+
+    most = numpy.maximum(numpy.maximum(r, g), b)
+    least = numpy.minimum(numpy.minimum(r, g), b)
+    lightness = (most + least) >> 1
+
+    # Avoid dividing by zero for grey pixels, their hue is set to 0 below
+    diff = numpy.where(most == least, 1, most - least)
+    hue = numpy.where(
+        most == r,
+        (g - b) * 255 // diff + numpy.where(g < b, 1530, 0),
+        numpy.where(
+            most == g,
+            (b - r) * 255 // diff + 510,
+            (r - g) * 255 // diff + 1020,
+        ),
+    ) // 6
+    hue = numpy.where(most == least, 0, hue)
+    luminance = (r * 0.2126 + g * 0.7152 + b * 0.0722).astype(numpy.int64)
+
+    top_two_bits = 0b11000000
+    packed = ((luminance & top_two_bits) << 4) | ((hue & top_two_bits) << 2) | (lightness & top_two_bits)
+
+    buckets = 1 << 12
+    counts = numpy.bincount(packed, minlength=buckets)
+    sums = [numpy.bincount(packed, weights=channel, minlength=buckets) for channel in (r, g, b)]
+
+    # Largest buckets first, ties broken by bucket index like colorgram does
+    used = numpy.flatnonzero(counts)
+    used = used[numpy.argsort(-counts[used], kind="stable")][:number_of_colors]
+
+    return [
+        tuple(int(channel_sums[bucket]) // int(counts[bucket]) for channel_sums in sums)
+        for bucket in used
+    ]
@@ -0,0 +1,394 @@
+import json
+import math
+import re
+import sqlite3
+import threading
+
+from algoliasearch.http.serializer import JSONEncoder
+
+# Algolia's textual ranking criteria, which all map to full text relevance here
+TEXTUAL_CRITERIA = ("typo", "geo", "words", "filters", "proximity", "attribute", "exact")
+
+class LocalSearchClient:
+    """
+    A stand-in for algoliasearch's SearchClient that keeps its indexes in a local SQLite
+    database, with full text search through FTS5. It implements the parts of the algolia
+    API that the Indexer uses, and a search() that understands the queries made by app.js.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.records_cache = {}
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS indexes (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL,
+                    settings TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS objects (
+                    id INTEGER PRIMARY KEY,
+                    index_id INTEGER NOT NULL,
+                    object_id TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    UNIQUE (index_id, object_id)
+                );
+            """)
+
+    def init_index(self, name):
+        return LocalSearchIndex(self, name)
+
+class LocalSearchIndex:
+    def __init__(self, client, name):
+        self.client = client
+        self.connection = client.connection
+        self.name = name
+
+    def get_settings(self):
+        with self.client.lock:
+            return self._settings(self.name)
+
+    def set_settings(self, settings, request_options=None):
+        with self.client.lock, self.connection:
+            current_settings = self._settings(self.name)
+            searchable_attributes = current_settings.get("searchableAttributes")
+            current_settings.update(settings)
+            self._save_settings(self.name, current_settings)
+
+            for replica_name in settings.get("replicas", []):
+                replica_settings = self._settings(replica_name)
+                replica_settings["primary"] = self.name
+                self._save_settings(replica_name, replica_settings)
+
+            if current_settings.get("searchableAttributes") != searchable_attributes:
+                self._rebuild_full_text_index()
+
+        return LocalIndexingResponse()
+
+    def save_objects(self, objects, request_options=None):
+        with self.client.lock, self.connection:
+            index_id = self._index_id(self.name)
+            searchable_attributes = self._searchable_attributes()
+            for obj in objects:
+                record = json.dumps(obj, cls=JSONEncoder)
+                row = self.connection.execute(
+                    "SELECT id FROM objects WHERE index_id = ? AND object_id = ?", (index_id, obj["objectID"])
+                ).fetchone()
+                if row:
+                    row_id = row[0]
+                    self.connection.execute("UPDATE objects SET record = ? WHERE id = ?", (record, row_id))
+                    self.connection.execute(f"DELETE FROM fts_{index_id} WHERE rowid = ?", (row_id,))
+                else:
+                    row_id = self.connection.execute(
+                        "INSERT INTO objects (index_id, object_id, record) VALUES (?, ?, ?)",
+                        (index_id, obj["objectID"], record),
+                    ).lastrowid
+
+                self._insert_full_text(index_id, row_id, json.loads(record), searchable_attributes)
+
+        return LocalIndexingResponse()
+
+    def delete_objects(self, object_ids, request_options=None):
+        with self.client.lock, self.connection:
+            index_id = self._index_id(self.name)
+            for object_id in object_ids:
+                row = self.connection.execute(
+                    "SELECT id FROM objects WHERE index_id = ? AND object_id = ?", (index_id, object_id)
+                ).fetchone()
+                if row:
+                    self.connection.execute("DELETE FROM objects WHERE id = ?", (row[0],))
+                    self.connection.execute(f"DELETE FROM fts_{index_id} WHERE rowid = ?", (row[0],))
+
+        return LocalIndexingResponse()
+
+    def browse_objects(self, request_options=None):
+        attributes = (request_options or {}).get("attributesToRetrieve")
+        for record in list(self._records(self._data_index_name()).values()):
+            if attributes:
+                record = {key: value for key, value in record.items() if key in attributes or key == "objectID"}
+
+            yield record
+
+    def search(self, query="", request_options=None):
+        options = request_options or {}
+        settings = self.get_settings()
+        data_index_name = self._data_index_name()
+        data_settings = self._settings(data_index_name)
+        records = self._records(data_index_name)
+
+        tokens = re.findall(r"\w+", query.lower())
+        if tokens:
+            relevance = self._match(data_index_name, tokens)
+            candidates = [records[row_id] for row_id in relevance]
+        else:
+            relevance = {}
+            candidates = list(records.values())
+
+        facet_filters = options.get("facetFilters", [])
+        numeric_filters = options.get("numericFilters", [])
+        candidates = [
+            record for record in candidates
+            if matches_facet_filters(record, facet_filters) and matches_numeric_filters(record, numeric_filters)
+        ]
+
+        row_ids = {id(record): row_id for row_id, record in records.items()}
+        for criterion in reversed(self._ranking(settings, data_settings)):
+            if criterion == "relevance":
+                candidates.sort(key=lambda record: relevance.get(row_ids[id(record)], 0))
+                continue
+
+            direction, attribute = re.match(r"(asc|desc)\((.+)\)", criterion).groups()
+            if direction == "asc":
+                candidates.sort(key=lambda record: (record.get(attribute) is None, record.get(attribute)))
+            else:
+                candidates.sort(key=lambda record: (record.get(attribute) is not None, record.get(attribute)),
+                                reverse=True)
+
+        facets = options.get("facets", [])
+        if "*" in facets:
+            facets = facet_paths(
+                records.values(),
+                [attribute_name(attribute) for attribute in data_settings.get("attributesForFaceting", [])],
+            )
+
+        hits_per_page = options.get("hitsPerPage", settings.get("hitsPerPage", data_settings.get("hitsPerPage", 20)))
+        page = options.get("page", 0)
+        hits = [
+            self._hit(record, tokens, data_settings)
+            for record in candidates[page * hits_per_page:(page + 1) * hits_per_page]
+        ]
+
+        return {
+            "hits": hits,
+            "nbHits": len(candidates),
+            "page": page,
+            "nbPages": math.ceil(len(candidates) / hits_per_page) if hits_per_page else 0,
+            "hitsPerPage": hits_per_page,
+            "facets": {
+                attribute: facet_counts(candidates, attribute, options.get("maxValuesPerFacet", 100))
+                for attribute in facets
+            },
+            "query": query,
+        }
+
+    def _ranking(self, settings, data_settings):
+        # Replicas sort by their own ranking, everything else by relevance and then customRanking
+        ranking = settings.get("ranking") or ["words", "custom"]
+        criteria = []
+        for criterion in ranking:
+            if criterion == "custom":
+                criteria += settings.get("customRanking", data_settings.get("customRanking", []))
+            elif criterion in TEXTUAL_CRITERIA:
+                if "relevance" not in criteria:
+                    criteria.append("relevance")
+            else:
+                criteria.append(criterion)
+
+        return criteria
+
+    def _match(self, index_name, tokens):
+        # All words have to match, and the last one is a prefix since the user might still be typing
+        fts_query = " ".join(f'"{token}"' for token in tokens) + "*"
+        index_id = self._index_id(index_name)
+        num_attributes = len(self._searchable_attributes(index_name))
+
+        # Weigh matches in earlier attributes much higher, like algolia's attribute criterion
+        weights = ", ".join(str(10 ** (num_attributes - i - 1)) for i in range(num_attributes))
+        with self.client.lock:
+            rows = self.connection.execute(
+                f"SELECT rowid, bm25(fts_{index_id}, {weights}) FROM fts_{index_id} WHERE fts_{index_id} MATCH ?",
+                (fts_query,),
+            ).fetchall()
+
+        return dict(rows)
+
+    def _hit(self, record, tokens, settings):
+        hit = dict(record)
+        pre_tag = settings.get("highlightPreTag", "<em>")
+        post_tag = settings.get("highlightPostTag", "</em>")
+        pattern = None
+        if tokens:
+            pattern = re.compile(
+                "|".join([rf"\b{re.escape(token)}\b" for token in tokens[:-1]] + [rf"\b{re.escape(tokens[-1])}\w*"]),
+                re.IGNORECASE,
+            )
+
+        hit["_highlightResult"] = {}
+        for attribute in self._searchable_attributes(self._data_index_name()):
+            value = record.get(attribute)
+            if not isinstance(value, str):
+                continue
+
+            highlighted = pattern.sub(lambda match: pre_tag + match.group(0) + post_tag, value) if pattern else value
+            hit["_highlightResult"][attribute] = {
+                "value": highlighted,
+                "matchLevel": "full" if highlighted != value else "none",
+            }
+
+        return hit
+
+    def _records(self, index_name):
+        # Decoding every record for every search is slow, so keep them until the database changes
+        with self.client.lock:
+            index_id = self._index_id(index_name)
+            version = (self.connection.total_changes, self.connection.execute("PRAGMA data_version").fetchone()[0])
+            cached = self.client.records_cache.get(index_id)
+            if cached and cached[0] == version:
+                return cached[1]
+
+            records = {
+                row_id: json.loads(record)
+                for row_id, record in self.connection.execute(
+                    "SELECT id, record FROM objects WHERE index_id = ? ORDER BY id", (index_id,)
+                )
+            }
+            self.client.records_cache[index_id] = (version, records)
+            return records
+
+    def _data_index_name(self):
+        # Replicas share their records with the primary index
+        return self.get_settings().get("primary", self.name)
+
+    def _searchable_attributes(self, index_name=None):
+        settings = self._settings(index_name or self.name)
+        return [attribute_name(attribute) for attribute in settings.get("searchableAttributes", ["name"])]
+
+    def _settings(self, index_name):
+        row = self.connection.execute("SELECT settings FROM indexes WHERE name = ?", (index_name,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _save_settings(self, index_name, settings):
+        self._index_id(index_name)
+        self.connection.execute(
+            "UPDATE indexes SET settings = ? WHERE name = ?", (json.dumps(settings), index_name)
+        )
+
+    def _index_id(self, index_name):
+        row = self.connection.execute("SELECT id FROM indexes WHERE name = ?", (index_name,)).fetchone()
+        if row:
+            return row[0]
+
+        index_id = self.connection.execute(
+            "INSERT INTO indexes (name, settings) VALUES (?, ?)", (index_name, "{}")
+        ).lastrowid
+        self._create_full_text_index(index_id, self._searchable_attributes(index_name))
+        return index_id
+
+    def _create_full_text_index(self, index_id, searchable_attributes):
+        columns = ", ".join(f"c{i}" for i in range(len(searchable_attributes)))
+        self.connection.execute(
+            f"CREATE VIRTUAL TABLE fts_{index_id} USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def _rebuild_full_text_index(self):
+        index_id = self._index_id(self.name)
+        searchable_attributes = self._searchable_attributes()
+        self.connection.execute(f"DROP TABLE IF EXISTS fts_{index_id}")
+        self._create_full_text_index(index_id, searchable_attributes)
+
+        rows = self.connection.execute("SELECT id, record FROM objects WHERE index_id = ?", (index_id,)).fetchall()
+        for row_id, record in rows:
+            self._insert_full_text(index_id, row_id, json.loads(record), searchable_attributes)
+
+    def _insert_full_text(self, index_id, row_id, record, searchable_attributes):
+        texts = [" ".join(str(value) for value in attribute_values(record, attribute))
+                 for attribute in searchable_attributes]
+        columns = ", ".join(f"c{i}" for i in range(len(texts)))
+        placeholders = ", ".join("?" * (len(texts) + 1))
+        self.connection.execute(
+            f"INSERT INTO fts_{index_id} (rowid, {columns}) VALUES ({placeholders})", [row_id] + texts
+        )
+
+class LocalIndexingResponse:
+    # Writes to the local index are synchronous, so there is never anything to wait for
+    def wait(self, request_options=None):
+        return self
+
+def attribute_name(attribute):
+    # Strip modifiers like unordered(name) or searchable(previous_players)
+    match = re.match(r"\w+\((.+)\)$", attribute)
+    return match.group(1) if match else attribute
+
+def facet_paths(records, attributes):
+    # Nested attributes like players facet on each of their keys, as players.level1 and players.level2
+    paths = []
+    for attribute in attributes:
+        keys = sorted({
+            key
+            for record in records
+            for value in attribute_values(record, attribute) if isinstance(value, dict)
+            for key in value
+        })
+        paths += [f"{attribute}.{key}" for key in keys] if keys else [attribute]
+
+    return paths
+
+def attribute_values(record, path):
+    # Resolve nested attributes like players.level1, flattening lists along the way
+    values = [record]
+    for key in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict) and key in value:
+                child = value[key]
+                if isinstance(child, list):
+                    next_values.extend(child)
+                elif child is not None:
+                    next_values.append(child)
+
+        values = next_values
+
+    return values
+
+def matches_facet_filters(record, facet_filters):
+    # Filters in the outer list are ANDed together, and filters in inner lists are ORed
+    for facet_filter in facet_filters:
+        alternatives = facet_filter if isinstance(facet_filter, list) else [facet_filter]
+        if not any(matches_facet_filter(record, alternative) for alternative in alternatives):
+            return False
+
+    return True
+
+def matches_facet_filter(record, facet_filter):
+    attribute, value = facet_filter.split(":", 1)
+    is_negated = value.startswith("-")
+    if is_negated:
+        value = value[1:]
+
+    is_match = value in [str(record_value) for record_value in attribute_values(record, attribute)]
+    return is_match != is_negated
+
+def matches_numeric_filters(record, numeric_filters):
+    for numeric_filter in numeric_filters:
+        alternatives = numeric_filter if isinstance(numeric_filter, list) else [numeric_filter]
+        if not any(matches_numeric_filter(record, alternative) for alternative in alternatives):
+            return False
+
+    return True
+
+def matches_numeric_filter(record, numeric_filter):
+    attribute, operator, number = re.match(r"\s*([\w.]+)\s*(<=|>=|!=|<|>|=)\s*(-?[\d.]+)\s*$", numeric_filter).groups()
+    number = float(number)
+    compare = {
+        "<": lambda value: value < number,
+        "<=": lambda value: value <= number,
+        "=": lambda value: value == number,
+        "!=": lambda value: value != number,
+        ">=": lambda value: value >= number,
+        ">": lambda value: value > number,
+    }[operator]
+    return any(
+        compare(float(value))
+        for value in attribute_values(record, attribute)
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    )
+
+def facet_counts(records, attribute, max_values):
+    counts = {}
+    for record in records:
+        for value in set(str(value) for value in attribute_values(record, attribute)):
+            counts[value] = counts.get(value, 0) + 1
+
+    top_values = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:max_values]
+    return dict(top_values)
@@ -1,8 +1,28 @@
-from decimal import Decimal
 import html
 
 
 class BoardGame:
+    # Collections can hold many thousands of games and expansions, so skip the per instance __dict__
+    __slots__ = (
+        "id",
+        "name",
+        "description",
+        "categories",
+        "mechanics",
+        "players",
+        "weight",
+        "playing_time",
+        "rank",
+        "usersrated",
+        "numowned",
+        "rating",
+        "numplays",
+        "image",
+        "tags",
+        "previous_players",
+        "expansions",
+    )
+
     def __init__(self, game_data, image="", tags=[], numplays=0, previous_players=[], expansions=[]):
         self.id = game_data["id"]
         self.name = game_data["name"]
@@ -22,13 +42,47 @@ class BoardGame:
         self.previous_players = previous_players
         self.expansions = expansions
 
+    def to_record(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "categories": self.categories,
+            "mechanics": self.mechanics,
+            "players": self.players,
+            "weight": self.weight,
+            "playing_time": self.playing_time,
+            "rank": self.rank,
+            "usersrated": self.usersrated,
+            "numowned": self.numowned,
+            "rating": self.rating,
+            "numplays": self.numplays,
+            "image": self.image,
+            "tags": self.tags,
+            "previous_players": self.previous_players,
+            "expansions": [expansion.to_record() for expansion in self.expansions],
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        # The inverse of to_record(), for games that were loaded from disk instead of downloaded
+        game = cls.__new__(cls)
+        for attribute in cls.__slots__:
+            setattr(game, attribute, record[attribute])
+
+        game.players = [tuple(players) for players in record["players"]]
+        game.expansions = [cls.from_record(expansion) for expansion in record["expansions"]]
+        return game
+
     def calc_num_players(self, game_data, expansions):
         num_players = game_data["suggested_numplayers"].copy()
+        seen_nums = {num for num, _ in num_players}
 
         # Add number of players from expansions
         for expansion in expansions:
             for expansion_num, _ in expansion.players:
-                if expansion_num not in [num for num, _ in num_players]:
+                if expansion_num not in seen_nums:
+                    seen_nums.add(expansion_num)
                     num_players.append((expansion_num, "expansion"))
 
         num_players = sorted(num_players, key=lambda x: int(x[0].replace("+", "")))
@@ -52,25 +106,25 @@ class BoardGame:
         if not game_data["rank"] or game_data["rank"] == "Not Ranked":
             return None
 
-        return Decimal(game_data["rank"])
+        return int(game_data["rank"])
 
     def calc_usersrated(self, game_data):
         if not game_data["usersrated"]:
             return 0
 
-        return Decimal(game_data["usersrated"])
+        return int(game_data["usersrated"])
 
     def calc_numowned(self, game_data):
         if not game_data["numowned"]:
             return 0
 
-        return Decimal(game_data["numowned"])
+        return int(game_data["numowned"])
 
     def calc_rating(self, game_data):
         if not game_data["rating"]:
             return None
 
-        return Decimal(game_data["rating"])
+        return float(game_data["rating"])
 
     def calc_weight(self, game_data):
         weight_mapping = {
@@ -81,4 +135,4 @@ class BoardGame:
             4: "Medium Heavy",
             5: "Heavy",
         }
-        return weight_mapping[round(Decimal(game_data["weight"] or 0))]
+        return weight_mapping[round(float(game_data["weight"] or 0))]
@@ -0,0 +1,103 @@
+import bisect
+import json
+import mmap
+import struct
+import zlib
+from collections.abc import Sequence
+
+from mybgg.files import atomic_write
+from mybgg.models import BoardGame
+
+MAGIC = b"MYBGGSNAP1\n"
+GAMES_PER_BLOCK = 256
+
+def save_snapshot(path, games, **metadata):
+    """
+    Writes a downloaded collection to disk, so that it can be indexed again without asking BGG.
+    Games are stored as lines of JSON, compressed together in blocks of GAMES_PER_BLOCK. A footer
+    at the end of the file tells where each block starts, so that games can be read one block at
+    a time instead of decompressing the whole file.
+    """
+    games = list(games)
+    blocks = []
+
+    with atomic_write(path, "wb") as f:
+        f.write(MAGIC)
+        for i in range(0, len(games), GAMES_PER_BLOCK):
+            block_games = games[i:i + GAMES_PER_BLOCK]
+            lines = "\n".join(json.dumps(game.to_record(), separators=(",", ":")) for game in block_games)
+            data = zlib.compress(lines.encode("utf-8"), 9)
+            blocks.append([f.tell(), len(data), len(block_games)])
+            f.write(data)
+
+        footer_offset = f.tell()
+        f.write(json.dumps({"blocks": blocks, "metadata": metadata}).encode("utf-8"))
+        f.write(struct.pack("<Q", footer_offset))
+
+class CollectionSnapshot(Sequence):
+    """
+    A collection saved by save_snapshot(), read lazily through a memory map. Only the block
+    holding the games being looked at is decompressed, so memory use stays flat no matter how
+    large the collection is.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a mybgg snapshot")
+
+        footer_offset, = struct.unpack("<Q", self.map[-8:])
+        footer = json.loads(self.map[footer_offset:-8].decode("utf-8"))
+        self.blocks = footer["blocks"]
+        self.metadata = footer["metadata"]
+
+        # Index of the first game in each block, to find the block holding a game
+        self.block_starts = []
+        num_games = 0
+        for _, _, block_size in self.blocks:
+            self.block_starts.append(num_games)
+            num_games += block_size
+        self.num_games = num_games
+
+        self.cached_block = (None, None)
+
+    def __len__(self):
+        return self.num_games
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.num_games))]
+
+        if i < 0:
+            i += self.num_games
+        if not 0 <= i < self.num_games:
+            raise IndexError("snapshot index out of range")
+
+        block_index = bisect.bisect_right(self.block_starts, i) - 1
+        lines = self._block_lines(block_index)
+        return BoardGame.from_record(json.loads(lines[i - self.block_starts[block_index]]))
+
+    def __iter__(self):
+        for block_index in range(len(self.blocks)):
+            for line in self._block_lines(block_index):
+                yield BoardGame.from_record(json.loads(line))
+
+    def _block_lines(self, block_index):
+        cached_index, lines = self.cached_block
+        if cached_index != block_index:
+            offset, length, _ = self.blocks[block_index]
+            lines = zlib.decompress(self.map[offset:offset + length]).decode("utf-8").split("\n")
+            self.cached_block = (block_index, lines)
+
+        return lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
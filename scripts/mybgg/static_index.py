@@ -0,0 +1,186 @@
+import base64
+import gzip
+import json
+import os
+import re
+import unicodedata
+
+from algoliasearch.http.serializer import JSONEncoder
+
+from mybgg.files import atomic_write
+from mybgg.local_search import attribute_name
+from mybgg.local_search import attribute_values
+from mybgg.local_search import facet_paths
+
+FORMAT_VERSION = 1
+
+class StaticIndexClient:
+    """
+    A stand-in for algoliasearch's SearchClient that collects the indexed games in memory, and
+    writes them to a gzipped JSON file that app.js can load once and search in the browser. Next
+    to the records, the file holds an inverted index over the searchable attributes, a bitmap of
+    matching games for each facet value, and the sort order of every replica.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.settings = {}
+        self.objects = {}
+
+        # Keep the previous export around, so that delta indexing only has to send what changed
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == FORMAT_VERSION:
+                self.settings = data["settings"]
+                for name, settings in self.settings.items():
+                    if "primary" not in settings:
+                        self.objects[name] = {record["objectID"]: record for record in data["records"]}
+
+    def init_index(self, name):
+        return StaticIndex(self, name)
+
+    def save(self):
+        primaries = [name for name, settings in self.settings.items() if "primary" not in settings]
+        assert len(primaries) <= 1, "A static index can only hold one primary index"
+        primary = primaries[0] if primaries else None
+        settings = self.settings.get(primary, {})
+
+        records = sort_records(self.objects.get(primary, {}).values(), settings.get("customRanking", []))
+        searchable_attributes = [attribute_name(attribute) for attribute in settings.get("searchableAttributes", [])]
+        facet_attributes = [attribute_name(attribute) for attribute in settings.get("attributesForFaceting", [])]
+
+        indexes = {}
+        if primary:
+            indexes[primary] = {"order": list(range(len(records))), "relevance": True}
+        for name, replica_settings in self.settings.items():
+            if replica_settings.get("primary") == primary and name != primary:
+                indexes[name] = {
+                    "order": sorted_positions(records, replica_settings.get("ranking", [])),
+                    "relevance": False,
+                }
+
+        data = {
+            "version": FORMAT_VERSION,
+            "settings": self.settings,
+            "indexes": indexes,
+            "records": records,
+            "searchable_attributes": searchable_attributes,
+            "terms": inverted_index(records, searchable_attributes),
+            "facets": facet_bitmaps(records, facet_attributes),
+        }
+
+        with atomic_write(self.path, "wb") as f, gzip.open(f, "wt", encoding="utf-8", compresslevel=9) as gz:
+            json.dump(data, gz, separators=(",", ":"))
+
+class StaticIndex:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get_settings(self):
+        return dict(self.client.settings.get(self.name, {}))
+
+    def set_settings(self, settings, request_options=None):
+        self.client.settings.setdefault(self.name, {}).update(settings)
+        for replica_name in settings.get("replicas", []):
+            self.client.settings.setdefault(replica_name, {})["primary"] = self.name
+
+        return StaticIndexingResponse()
+
+    def save_objects(self, objects, request_options=None):
+        index_objects = self.client.objects.setdefault(self.name, {})
+        for obj in objects:
+            # Round trip through algolia's encoder, so that the records look just like algolia's
+            index_objects[obj["objectID"]] = json.loads(json.dumps(obj, cls=JSONEncoder))
+
+        return StaticIndexingResponse()
+
+    def delete_objects(self, object_ids, request_options=None):
+        index_objects = self.client.objects.setdefault(self.name, {})
+        for object_id in object_ids:
+            index_objects.pop(object_id, None)
+
+        return StaticIndexingResponse()
+
+    def browse_objects(self, request_options=None):
+        attributes = (request_options or {}).get("attributesToRetrieve")
+        for record in list(self.client.objects.get(self.name, {}).values()):
+            if attributes:
+                record = {key: value for key, value in record.items() if key in attributes or key == "objectID"}
+
+            yield record
+
+class StaticIndexingResponse:
+    # Nothing is sent anywhere until the client is saved, so there is never anything to wait for
+    def wait(self, request_options=None):
+        return self
+
+def tokenize(text):
+    # Must match tokenize() in app.js, or searches in the browser won't find anything
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r"[^\W_]+", text.lower())
+
+def sort_records(records, ranking):
+    # Games without a value always sort last, no matter the direction
+    records = list(records)
+    for criterion in reversed(ranking):
+        match = re.match(r"(asc|desc)\((.+)\)", criterion)
+        if not match:
+            continue
+
+        direction, attribute = match.groups()
+        if direction == "asc":
+            records.sort(key=lambda record: (record.get(attribute) is None, record.get(attribute)))
+        else:
+            records.sort(key=lambda record: (record.get(attribute) is not None, record.get(attribute)), reverse=True)
+
+    return records
+
+def sorted_positions(records, ranking):
+    positions = {id(record): position for position, record in enumerate(records)}
+    return [positions[id(record)] for record in sort_records(records, ranking)]
+
+def inverted_index(records, attributes):
+    """
+    Maps every word to the games it's found in, as a sorted list of [term, postings...] with one
+    list of delta encoded record positions per searchable attribute. The list is sorted so that
+    the browser can find all words starting with a prefix with a binary search.
+    """
+    postings = {}
+    for position, record in enumerate(records):
+        for attribute_index, attribute in enumerate(attributes):
+            terms = {term for value in attribute_values(record, attribute) for term in tokenize(value)}
+            for term in terms:
+                term_postings = postings.setdefault(term, [[] for _ in attributes])
+                term_postings[attribute_index].append(position)
+
+    return [[term] + [delta_encode(positions) for positions in postings[term]] for term in sorted(postings)]
+
+def delta_encode(positions):
+    previous = 0
+    deltas = []
+    for position in positions:
+        deltas.append(position - previous)
+        previous = position
+
+    return deltas
+
+def facet_bitmaps(records, attributes):
+    """
+    A base64 encoded bitmap of the games with each facet value, with one bit per record position.
+    Filtering and counting facets in the browser is then a matter of ANDing words together.
+    """
+    num_bytes = (len(records) + 31) // 32 * 4
+    facets = {}
+    for path in facet_paths(records, attributes):
+        bitmaps = {}
+        for position, record in enumerate(records):
+            for value in attribute_values(record, path):
+                bitmap = bitmaps.setdefault(str(value), bytearray(num_bytes))
+                bitmap[position // 8] |= 1 << (position % 8)
+
+        facets[path] = {value: base64.b64encode(bytes(bitmap)).decode("ascii") for value, bitmap in bitmaps.items()}
+
+    return facets